@@ -1,9 +1,14 @@
+import heapq
+import sys
+from copy import copy
+from functools import lru_cache
 from importlib.resources import files
 from random import random, choice
+from time import perf_counter
+from typing import Iterable, Iterator
 
 import pygame
 from pygame.colordict import THECOLORS
-from pgcooldown import Cooldown
 
 type EntityID = int
 type ComponentID = str
@@ -13,12 +18,22 @@ type System = callable
 type EntityMap = dict[EntityID, dict[ComponentID, Component]]
 type ComponentMap = dict[ComponentID, dict[EntityID, Component]]
 type SystemMap = dict[SystemID, System]
+# Called with the component map, the system is skipped when it's false
+type Condition = callable
 
 DISPLAY_SIZE = pygame.Vector2(1920, 1080)
 FPS = 60
-DT_MAX = 3 / FPS
+# Systems run in fixed steps, at most MAX_STEPS per frame; frame time
+# beyond that is dropped
+STEP = 1 / FPS
+MAX_STEPS = 3
+DT_MAX = MAX_STEPS * STEP
 SPEED = 100
 SHRAPNEL_SPEED = 500
+COLORS = list(THECOLORS)
+# Entity holding the "timers" component: simulation time, a heap of
+# (deadline, eid) and the last eid whose lifetime was scheduled
+TIMERS: EntityID = 0
 
 
 def create_surface(
@@ -36,6 +51,22 @@ def create_surface(
     return surface
 
 
+@lru_cache(maxsize=1024)
+def shared_surface(
+    size: tuple[int, int], fill_color: str | None = None, color_key: str | None = None
+) -> pygame.Surface:
+    """Interned surface for a size and colors, shared by every entity using
+    it, so it must not be drawn on"""
+    return create_surface(size, fill_color, color_key)
+
+
+@lru_cache(maxsize=1)
+def shrapnel_surface() -> pygame.Surface:
+    image = create_surface((8, 8), color_key="black")
+    pygame.draw.circle(image, "yellow", (4, 4), 4)
+    return image
+
+
 def add_components(
     emap: EntityMap,
     cmap: ComponentMap,
@@ -78,89 +109,132 @@ def remove_entity(
     eid: EntityID,
 ) -> tuple[EntityMap, ComponentMap]:
     if eid in emap:
-        del emap[eid]
-
-        for cid, entities in cmap.items():
-            if eid in entities:
-                del cmap[cid][eid]
+        for cid in emap.pop(eid):
+            del cmap[cid][eid]
 
     return emap, cmap
 
 
-def make_square(
+def remove_entities(
     emap: EntityMap,
     cmap: ComponentMap,
-    eid: EntityID,
-    pos: pygame.Vector2,
-    boundary: pygame.FRect,
-    audio: pygame.Sound,
+    eids: Iterable[EntityID],
 ) -> tuple[EntityMap, ComponentMap]:
+    for eid in eids:
+        if eid in emap:
+            for cid in emap.pop(eid):
+                del cmap[cid][eid]
+
+    return emap, cmap
+
+
+def make_square(pos: pygame.Vector2) -> dict[ComponentID, Component]:
     speed = pygame.Vector2(1, 0).rotate(random() * 360) * SPEED
-    image = create_surface((16, 16), choice(list(THECOLORS)))
-    lifetime = Cooldown(random() * 3 + 3)
-
-    return add_components(
-        emap,
-        cmap,
-        eid,
-        (
-            ("pos", pos),
-            ("speed", speed),
-            ("image", image),
-            ("boundary", boundary),
-            ("lifetime", lifetime),
-            ("explode", True),
-            ("audio", audio),
-        ),
-    )
+    image = shared_surface((16, 16), choice(COLORS))
+    lifetime = random() * 3 + 3
 
+    return {"pos": pos, "speed": speed, "image": image, "lifetime": lifetime}
 
-def mk_shrapnel(
-    emap: EntityMap, cmap: ComponentMap, eid: EntityID, pos: pygame.Vector2
-) -> tuple[EntityMap, ComponentMap]:
+
+def mk_shrapnel(pos: pygame.Vector2) -> dict[ComponentID, Component]:
     speed = (
         pygame.Vector2(1, 0).rotate(random() * 360)
         * SHRAPNEL_SPEED
         * (random() * 0.5 + 0.5)
     )
-    image = create_surface((8, 8), color_key="black")
-    pygame.draw.circle(image, "yellow", (4, 4), 4)
-    lifetime = Cooldown(random() * 0.2 + 0.1)
+    lifetime = random() * 0.2 + 0.1
 
-    return add_components(
-        emap,
-        cmap,
-        eid,
-        (("pos", pos), ("speed", speed), ("image", image), ("lifetime", lifetime)),
-    )
+    return {"pos": pos, "speed": speed, "lifetime": lifetime}
+
+
+def instantiate(
+    emap: EntityMap,
+    cmap: ComponentMap,
+    eid: EntityID,
+    prefab: dict[ComponentID, Component],
+    overrides: list[dict[ComponentID, Component]],
+    shared: Iterable[ComponentID] = (),
+) -> tuple[EntityMap, ComponentMap, EntityID]:
+    """Spawns one entity per override on top of the prefab's components,
+    filling each component store with a single update
+
+    Every instance gets its own copy of the prefab's components, except
+    for those in shared, like images and sounds.
+    """
+    eids = range(eid + 1, eid + 1 + len(overrides))
+    copied = [cid for cid in prefab if cid not in shared]
+    rows = [
+        {
+            **prefab,
+            **{cid: copy(prefab[cid]) for cid in copied if cid not in override},
+            **override,
+        }
+        for override in overrides
+    ]
+    emap.update(zip(eids, rows))
+
+    cids = prefab.keys() | {cid for override in overrides for cid in override}
+    for cid in cids:
+        if cid not in cmap:
+            cmap[cid] = {}
+        cmap[cid].update((e, row[cid]) for e, row in zip(eids, rows) if cid in row)
+
+    return emap, cmap, eid + len(overrides)
 
 
 def quary_components(
-    emap: EntityMap, cids: tuple[ComponentID, ...]
+    cmap: ComponentMap, cids: tuple[ComponentID, ...]
 ) -> dict[EntityID, dict[ComponentID, Component]]:
-    quary = {}
-    comp_count = len(cids)
+    stores = []
+    for cid in cids:
+        if cid not in cmap:
+            return {}
+        stores.append(cmap[cid])
+
+    smallest = min(stores, key=len, default={})
+    matched = smallest.keys()
+    for store in stores:
+        if store is not smallest:
+            matched = matched & store.keys()
+
+    columns = tuple(zip(cids, stores))
+    return {
+        eid: {cid: store[eid] for cid, store in columns}
+        for eid in smallest
+        if eid in matched
+    }
 
-    temp = {}
-    for eid, components in emap.items():
-        temp = {}
 
-        for cid in cids:
-            if cid in components:
-                temp[cid] = components[cid]
+def quary_tuples(
+    cmap: ComponentMap, cids: tuple[ComponentID, ...], with_eid: bool = True
+) -> Iterator[tuple]:
+    """Lazily yields (eid, c1, c2, ...), or (c1, c2, ...) without with_eid,
+    for the entities having all cids
 
-        if len(temp) == comp_count:
-            quary[eid] = {}
-            quary[eid] = temp
+    The matches are fixed up front, so entities can be added while
+    iterating but not removed.
+    """
+    stores = []
+    for cid in cids:
+        if cid not in cmap:
+            return iter(())
+        stores.append(cmap[cid])
 
-    return quary
+    smallest = min(stores, key=len, default={})
+    eids = smallest.keys()
+    for store in stores:
+        if store is not smallest:
+            eids = filter(store.__contains__, eids)
+    eids = tuple(eids)
+
+    columns = [map(store.__getitem__, eids) for store in stores]
+    return zip(eids, *columns) if with_eid else zip(*columns)
 
 
 def speed_system(
     emap: EntityMap, cmap: ComponentMap, dt: float, eid: EntityID
 ) -> tuple[EntityMap, ComponentMap, EntityID]:
-    for components in quary_components(emap, ("pos", "speed")).values():
-        pos, speed = components.values()
+    for pos, speed in quary_tuples(cmap, ("pos", "speed"), False):
         pos += speed * dt
 
     return emap, cmap, eid
@@ -169,10 +243,23 @@ def speed_system(
 def lifetime_system(
     emap: EntityMap, cmap: ComponentMap, dt: float, eid: EntityID
 ) -> tuple[EntityMap, ComponentMap, EntityID]:
-    for eid, components in emap.items():
-        if not components["lifetime"].cold():
-            continue
-        add_component(emap, cmap, eid, "dead", True)
+    """Marks entities dead once their lifetime in seconds has passed
+
+    Entities spawned since the last run are pushed on a heap of
+    deadlines, so a step only touches new and expired entities.
+    """
+    timers = cmap["timers"][TIMERS]
+    timers["time"] += dt
+    heap, lifetimes = timers["heap"], cmap.get("lifetime", {})
+    for new_eid in range(timers["scheduled"] + 1, eid + 1):
+        if new_eid in lifetimes:
+            heapq.heappush(heap, (timers["time"] + lifetimes[new_eid], new_eid))
+    timers["scheduled"] = eid
+
+    while heap and heap[0][0] <= timers["time"]:
+        _, expired_eid = heapq.heappop(heap)
+        if expired_eid in emap:
+            emap, cmap = add_component(emap, cmap, expired_eid, "dead", True)
 
     return emap, cmap, eid
 
@@ -180,18 +267,16 @@ def lifetime_system(
 def dead_system(
     emap: EntityMap, cmap: ComponentMap, dt: float, eid: EntityID
 ) -> tuple[EntityMap, ComponentMap, EntityID]:
-    for eid in quary_components(emap, ("dead",)):
-        emap, cmap = remove_entity(emap, cmap, eid)
+    emap, cmap = remove_entities(emap, cmap, quary_components(cmap, ("dead",)))
     return emap, cmap, eid
 
 
 def boundary_system(
     emap: EntityMap, cmap: ComponentMap, dt: float, eid: EntityID
 ) -> tuple[EntityMap, ComponentMap, EntityID]:
-    for components in quary_components(
-        emap, ("pos", "speed", "boundary", "image")
-    ).values():
-        position, speed, boundary, image = components.values()
+    for position, speed, boundary, image in quary_tuples(
+        cmap, ("pos", "speed", "boundary", "image"), False
+    ):
         if not (0 < position.x < (boundary.width - image.width)):
             speed.x = -speed.x
         if not (0 < position.y < (boundary.height - image.height)):
@@ -203,14 +288,17 @@ def boundary_system(
 def explode_system(
     emap: EntityMap, cmap: ComponentMap, dt: float, eid: EntityID
 ) -> tuple[EntityMap, ComponentMap, EntityID]:
-    for components in quary_components(
-        emap, ("pos", "dead", "explode", "audio")
-    ).values():
-        pos, dead, explode, audio = components.values()
-
-        for _ in range(5):
-            eid += 1
-            emap, cmap = mk_shrapnel(emap, cmap, eid, pos.copy())
+    for pos, dead, explode, audio in quary_tuples(
+        cmap, ("pos", "dead", "explode", "audio"), False
+    ):
+        emap, cmap, eid = instantiate(
+            emap,
+            cmap,
+            eid,
+            {"image": shrapnel_surface()},
+            [mk_shrapnel(pos.copy()) for _ in range(5)],
+            ("image",),
+        )
 
         audio.play()
 
@@ -218,18 +306,48 @@ def explode_system(
 
 
 def run_systems(
-    emap: EntityMap, cmap: ComponentMap, smap: SystemMap, dt: float, eid: EntityID
+    emap: EntityMap,
+    cmap: ComponentMap,
+    smap: SystemMap,
+    dt: float,
+    eid: EntityID,
+    timings: dict[SystemID, float] | None = None,
+    conditions: dict[SystemID, Condition] | None = None,
 ) -> tuple[EntityMap, ComponentMap, EntityID]:
-    for system in smap.values():
+    for sid, system in smap.items():
+        if conditions and sid in conditions and not conditions[sid](cmap):
+            if timings is not None:
+                timings[sid] = 0.0
+            continue
+        if timings is None:
+            emap, cmap, eid = system(emap, cmap, dt, eid)
+            continue
+
+        start = perf_counter()
         emap, cmap, eid = system(emap, cmap, dt, eid)
+        timings[sid] = perf_counter() - start
 
     return emap, cmap, eid
 
 
-def draw_entities(surface: pygame.Surface, emap: EntityMap) -> None:
-    for components in quary_components(emap, ("image", "pos")).values():
-        image, pos = components.values()
-        surface.blit(image, pos)
+def draw_entities(
+    surface: pygame.Surface,
+    cmap: ComponentMap,
+    previous: dict[EntityID, pygame.Vector2] | None = None,
+    alpha: float = 1.0,
+) -> None:
+    """Draws entities between their previous and current position"""
+    images, positions = cmap.get("image", {}), cmap.get("pos", {})
+    previous = previous or {}
+    surface.fblits(
+        [
+            (image, previous[eid].lerp(positions[eid], alpha))
+            if eid in previous
+            else (image, positions[eid])
+            for eid, image in images.items()
+            if eid in positions
+        ]
+    )
 
 
 def main() -> None:
@@ -241,9 +359,22 @@ def main() -> None:
     sound = pygame.mixer.Sound(files("pygame.examples.data") / "car_door.wav")
     pygame.mixer.set_num_channels(64)
 
-    entity_id: EntityID = 0
+    square = {
+        "boundary": pygame.FRect(0, 0, *DISPLAY_SIZE.xy),
+        "explode": True,
+        "audio": sound,
+    }
+
+    entity_id: EntityID = TIMERS
     entities: EntityMap = {}
     components: ComponentMap = {}
+    entities, components = add_component(
+        entities,
+        components,
+        TIMERS,
+        "timers",
+        {"time": 0.0, "heap": [], "scheduled": TIMERS},
+    )
     systems: SystemMap = {
         "speed": speed_system,
         "boundary": boundary_system,
@@ -251,10 +382,33 @@ def main() -> None:
         "explode": explode_system,
         "dead": dead_system,
     }
+    # Exploding and reaping only matter once something died
+    conditions: dict[SystemID, Condition] = {
+        "explode": lambda cmap: bool(cmap.get("dead")),
+        "dead": lambda cmap: bool(cmap.get("dead")),
+    }
+
+    # Time spent per system and in draw during the previous frame, slow
+    # frames are reported with --profile
+    timings: dict[SystemID, float] | None = {} if "--profile" in sys.argv else None
+    accumulator = 0.0
+    # Positions before the last step, to interpolate from
+    previous: dict[EntityID, pygame.Vector2] = {}
 
     running = True
     while running:
-        dt = min(clock.tick(FPS) / 1000.0, DT_MAX)
+        frame_time = clock.tick(FPS) / 1000.0
+        if frame_time > DT_MAX and timings:
+            print(
+                f"slow frame {frame_time * 1000:.1f} ms:",
+                ", ".join(f"{sid} {t * 1000:.2f} ms" for sid, t in timings.items()),
+            )
+        accumulator += frame_time
+        steps = int(accumulator // STEP)
+        if steps > MAX_STEPS:
+            accumulator -= (steps - MAX_STEPS) * STEP
+            steps = MAX_STEPS
+        accumulator -= steps * STEP
 
         # Events
         for e in pygame.event.get():
@@ -264,27 +418,34 @@ def main() -> None:
                 if e.key == pygame.K_ESCAPE:
                     running = False
 
-        if pygame.mouse.get_pressed()[0]:
-            mouse = pygame.mouse.get_pos()
-            for _ in range(5):
-                entity_id += 1
-                entities, components = make_square(
+        mouse = pygame.mouse.get_pos() if pygame.mouse.get_pressed()[0] else None
+        for step in range(steps):
+            if step == steps - 1:
+                previous = {
+                    eid: pos.copy() for eid, pos in components.get("pos", {}).items()
+                }
+
+            if mouse is not None:
+                entities, components, entity_id = instantiate(
                     entities,
                     components,
                     entity_id,
-                    pygame.Vector2(mouse),
-                    pygame.FRect(0, 0, *DISPLAY_SIZE.xy),
-                    sound,
+                    square,
+                    [make_square(pygame.Vector2(mouse)) for _ in range(5)],
+                    ("audio",),
                 )
 
-        # Systems
-        entities, components, entity_id = run_systems(
-            entities, components, systems, dt, entity_id
-        )
+            # Systems
+            entities, components, entity_id = run_systems(
+                entities, components, systems, STEP, entity_id, timings, conditions
+            )
 
         # Render
         screen.fill("black")
-        draw_entities(screen, entities)
+        start = perf_counter()
+        draw_entities(screen, components, previous, accumulator / STEP)
+        if timings is not None:
+            timings["draw"] = perf_counter() - start
         pygame.display.flip()
 
 
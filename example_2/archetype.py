@@ -0,0 +1,250 @@
+"""Archetype storage: entities sharing a component set live in one table
+
+Columns are plain lists unless the component was declared numeric with
+declare_column, in which case the column is a NumPy array that grows by
+doubling and only its first len(table['eids']) rows are live.
+"""
+
+from itertools import islice, repeat
+from typing import Iterable, Iterator, Sequence
+from tp import *
+from registry import cids_mask, query_mask
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMN_CAPACITY = 64
+
+def declare_column(
+    world: WorldData,
+    cid: ComponentID,
+    dtype: str = 'f8',
+    shape: tuple[int, ...] = (),
+) -> None:
+    """Stores cid in NumPy arrays in every table that holds it"""
+    if np is None:
+        raise ImportError("numeric columns need numpy")
+    if world['storage'] != 'archetype':
+        raise ValueError("numeric columns need archetype storage")
+    if any(cid in table['cids'] for table in world['tables'].values()):
+        raise ValueError(f"{cid!r} already has rows, declare it before use")
+
+    world['columns'][cid] = {'dtype': dtype, 'shape': shape}
+
+def _new_column(world: WorldData, cid: ComponentID) -> Column:
+    spec = world['columns'].get(cid)
+    if spec is None:
+        return []
+    return np.zeros((COLUMN_CAPACITY, *spec['shape']), spec['dtype'])
+
+def get_table(world: WorldData, cids: frozenset[ComponentID]) -> Table:
+    signature = cids_mask(world, cids)
+    tables = world['tables']
+    if signature not in tables:
+        tables[signature] = {
+            'cids': cids,
+            'signature': signature,
+            'eids': [],
+            'columns': {cid: _new_column(world, cid) for cid in cids},
+        }
+
+    return tables[signature]
+
+def _append_row(
+    table: Table, eid: EntityID, values: dict[ComponentID, Component]
+) -> int:
+    row = len(table['eids'])
+    table['eids'].append(eid)
+    columns = table['columns']
+    for cid, column in columns.items():
+        if isinstance(column, list):
+            column.append(values[cid])
+            continue
+        if row == len(column):
+            column = columns[cid] = np.concatenate((column, np.zeros_like(column)))
+        column[row] = values[cid]
+
+    return row
+
+def table_extend(
+    world: WorldData,
+    table: Table,
+    eids: Sequence[EntityID],
+    columns: dict[ComponentID, Sequence[Component]],
+) -> None:
+    """Appends a row per new entity, growing NumPy columns at most once
+
+    An empty table adopts NumPy arrays of the declared dtype as they are,
+    so columns loaded from a file can stay memory-mapped.
+    """
+    start = len(table['eids'])
+    table['eids'].extend(eids)
+    size = len(table['eids'])
+    for cid, column in table['columns'].items():
+        values = columns[cid]
+        if isinstance(column, list):
+            column.extend(values)
+            continue
+        if (
+            start == 0
+            and size
+            and isinstance(values, np.ndarray)
+            and values.dtype == column.dtype
+            and values.shape[1:] == column.shape[1:]
+        ):
+            table['columns'][cid] = values
+            continue
+        if size > len(column):
+            capacity = len(column)
+            while capacity < size:
+                capacity *= 2
+            grown = np.zeros((capacity, *column.shape[1:]), column.dtype)
+            grown[:start] = column[:start]
+            column = table['columns'][cid] = grown
+        column[start:size] = values
+
+    world['locations'].update(
+        zip(eids, ((table, row) for row in range(start, size)))
+    )
+
+def _remove_row(world: WorldData, table: Table, row: int) -> None:
+    eids = table['eids']
+    last = len(eids) - 1
+    moved = eids[last]
+    eids[row] = moved
+    eids.pop()
+    for column in table['columns'].values():
+        column[row] = column[last]
+        if isinstance(column, list):
+            column.pop()
+
+    if row != last:
+        world['locations'][moved] = (table, row)
+
+def table_set(
+    world: WorldData,
+    eid: EntityID,
+    components: Iterable[tuple[ComponentID, Component]],
+) -> list[ComponentID]:
+    """Writes components, moving eid to another table if its set grew
+
+    Returns the cids that were newly attached to the entity.
+    """
+    locations = world['locations']
+    components = dict(components)
+
+    if eid in locations:
+        old, old_row = locations[eid]
+        added = [cid for cid in components if cid not in old['cids']]
+        if not added:
+            for cid, component in components.items():
+                old['columns'][cid][old_row] = component
+            return added
+
+        values = {cid: column[old_row] for cid, column in old['columns'].items()}
+    else:
+        old, old_row = None, 0
+        added = list(components)
+        values = {}
+
+    values.update(components)
+    table = get_table(world, frozenset(values))
+    row = _append_row(table, eid, values)
+    if old is not None:
+        _remove_row(world, old, old_row)
+    locations[eid] = (table, row)
+
+    return added
+
+def table_unset(
+    world: WorldData, eid: EntityID, cids: Iterable[ComponentID]
+) -> list[ComponentID]:
+    """Moves eid to the table without cids, returns the cids it lost"""
+    old, old_row = world['locations'][eid]
+    removed = [cid for cid in cids if cid in old['cids']]
+    if not removed:
+        return removed
+
+    values = {
+        cid: column[old_row]
+        for cid, column in old['columns'].items()
+        if cid not in removed
+    }
+    table = get_table(world, frozenset(values))
+    row = _append_row(table, eid, values)
+    _remove_row(world, old, old_row)
+    world['locations'][eid] = (table, row)
+
+    return removed
+
+def table_remove(world: WorldData, eid: EntityID) -> frozenset[ComponentID]:
+    """Swap-removes the entity's row, returns the cids it had"""
+    table, row = world['locations'].pop(eid)
+    _remove_row(world, table, row)
+
+    return table['cids']
+
+def table_get(world: WorldData, eid: EntityID, cid: ComponentID) -> Component:
+    table, row = world['locations'][eid]
+    return table['columns'][cid][row]
+
+def matching_tables(world: WorldData, cids: Query) -> list[Table]:
+    mask = query_mask(world, cids)
+    return [
+        table
+        for signature, table in world['tables'].items()
+        if signature & mask == mask and table['eids']
+    ]
+
+def table_quary(
+    world: WorldData, cids: Query
+) -> dict[EntityID, dict[ComponentID, Component]]:
+    """Iterates every matching table row by row"""
+    quary = {}
+    for table in matching_tables(world, cids):
+        columns = tuple((cid, table['columns'][cid]) for cid in cids)
+        for row, eid in enumerate(table['eids']):
+            quary[eid] = {cid: column[row] for cid, column in columns}
+
+    return quary
+
+def table_rows(
+    table: Table, cids: Query, with_eid: bool = True, optional: Query = ()
+) -> Iterator[tuple]:
+    """Zips the table's rows of cids then optional, led by the eid with
+    with_eid; optional components the table lacks are None
+
+    Only the rows the table has when this is called are zipped, rows
+    appended while iterating are left out.
+    """
+    size = len(table['eids'])
+    columns = [
+        column if isinstance(column, list) else column[:size]
+        for column in (table['columns'][cid] for cid in cids)
+    ]
+    for cid in optional:
+        column = table['columns'].get(cid)
+        if column is None:
+            columns.append(repeat(None, size))
+        else:
+            columns.append(column if isinstance(column, list) else column[:size])
+    rows = zip(table['eids'], *columns) if with_eid else zip(*columns)
+    return islice(rows, size)
+
+def table_columns(world: WorldData, cids: Query) -> Iterator[tuple]:
+    """Yields (eids, column, ...) for every matching table
+
+    NumPy columns are sliced to the live rows, so they are views that
+    can be updated in place; list columns are yielded as they are.
+    """
+    for table in matching_tables(world, cids):
+        size = len(table['eids'])
+        yield (
+            table['eids'],
+            *(
+                column if isinstance(column, list) else column[:size]
+                for column in (table['columns'][cid] for cid in cids)
+            ),
+        )
@@ -0,0 +1,30 @@
+"""Interned immutable assets shared between entities, evicted LRU first"""
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+from tp import *
+
+def create_assets(capacity: int = 256) -> AssetStore:
+    return {'capacity': capacity, 'items': OrderedDict(), 'hits': 0, 'misses': 0}
+
+def intern_asset(
+    world: WorldData, key: Hashable, factory: Callable[[], object]
+) -> object:
+    """Returns the asset stored under key, building it with factory once
+
+    Assets must not be mutated by their users since they are shared.
+    Evicting an asset only drops the store's reference to it.
+    """
+    store = world['assets']
+    items = store['items']
+    if key in items:
+        items.move_to_end(key)
+        store['hits'] += 1
+        return items[key]
+
+    store['misses'] += 1
+    asset = items[key] = factory()
+    if len(items) > store['capacity']:
+        items.popitem(last=False)
+
+    return asset
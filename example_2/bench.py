@@ -0,0 +1,1050 @@
+"""Headless benchmarks for the ecs module
+
+Run everything with `python bench.py` or pick by name, e.g.
+`python bench.py query squares`. Micro-benchmarks print their own
+timings. Scenarios replay the examples frame by frame from a fixed seed
+and report ops/sec, frame time percentiles and peak traced memory.
+
+`--save FILE` stores the scenario results as a baseline, and
+`--baseline FILE` compares against one. It flags, and exits 1 on,
+results more than `--tolerance` worse.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+from timeit import timeit
+
+from ecs import (
+    add_after,
+    add_channel,
+    add_component,
+    get_component,
+    has_components,
+    add_components,
+    add_tags,
+    at_rate,
+    instantiate,
+    last_run,
+    batch_system,
+    create_world,
+    declare_access,
+    declare_column,
+    declare_schema,
+    disable_parallel,
+    disable_profiling,
+    emit,
+    enable_parallel,
+    enable_profiling,
+    format_stages,
+    get_schedule,
+    enable_spatial,
+    quary_columns,
+    quary_components,
+    quary_rect,
+    quary_tuples,
+    read_events,
+    query_mask,
+    register_prefab,
+    register_view,
+    remove_entities,
+    remove_entity,
+    run_if,
+    run_systems,
+    spatial_system,
+    spawn_entity,
+    track_changes,
+    when_events,
+    world_memory,
+)
+from manager import add_factory, create_manager, switch_world
+from render import draw_sprites
+from snapshot import load_snapshot, save_snapshot
+from tp import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+except ImportError:
+    pygame = None
+
+SIZES = (1_000, 10_000, 100_000)
+RARE_EVERY = 1_000
+
+
+def make_world(storage: Storage = 'dict') -> WorldData:
+    return create_world({}, storage=storage)
+
+
+def populate(world: WorldData, count: int) -> WorldData:
+    for eid in range(1, count + 1):
+        add_components(
+            world,
+            eid,
+            (
+                ("position", [0.0, 0.0]),
+                ("velocity", [1.0, 1.0]),
+                ("size", [8.0, 8.0]),
+            ),
+        )
+        if eid % RARE_EVERY == 0:
+            add_components(world, eid, (("dead", True),))
+
+    return world
+
+
+def scan_query(
+    world: WorldData, cids: tuple[ComponentID, ...]
+) -> dict[EntityID, dict[ComponentID, Component]]:
+    """The entity scan quary_components used before the component index"""
+    quary = {}
+    comp_count = len(cids)
+
+    for eid, components in world['entities'].items():
+        temp = {}
+
+        for cid in cids:
+            if cid in components:
+                temp[cid] = components[cid]
+
+        if len(temp) == comp_count:
+            quary[eid] = temp
+
+    return quary
+
+
+def scan_remove(world: WorldData, eid: EntityID) -> None:
+    """The remove_entity that probed every component store"""
+    emap, cmap = world['entities'], world['components']
+    if eid in emap:
+        del emap[eid]
+
+        for cid, entities in cmap.items():
+            if eid in entities:
+                del cmap[cid][eid]
+
+
+def report(name: str, count: int, seconds: float, loops: int) -> None:
+    print(f"{name:<32} {count:>8} entities {seconds / loops * 1e6:>12.1f} us/op")
+
+
+def bench_query() -> None:
+    for count in SIZES:
+        world = populate(make_world(), count)
+        loops = max(1, 100_000 // count)
+
+        for cids in (("position", "velocity"), ("dead", "position")):
+            assert scan_query(world, cids) == quary_components(world, cids)
+            label = ",".join(cids)
+            seconds = timeit(lambda: scan_query(world, cids), number=loops)
+            report(f"scan  {label}", count, seconds, loops)
+            seconds = timeit(lambda: quary_components(world, cids), number=loops)
+            report(f"index {label}", count, seconds, loops)
+
+
+def bench_views() -> None:
+    for count in SIZES:
+        world = populate(make_world(), count)
+        loops = max(1, 100_000 // count)
+
+        for cids in (("position", "velocity"), ("dead", "position")):
+            label = ",".join(cids)
+            seconds = timeit(lambda: quary_components(world, cids), number=loops)
+            report(f"miss  {label}", count, seconds, loops)
+            register_view(world, cids)
+            seconds = timeit(lambda: quary_components(world, cids), number=loops)
+            report(f"view  {label}", count, seconds, loops)
+
+        print(f"query stats {world['query_stats']}")
+
+
+def churn(world: WorldData, count: int) -> None:
+    for eid in range(1, count + 1, 10):
+        remove_entity(world, eid)
+    for eid in range(1, count + 1, 10):
+        add_components(world, eid, (("position", [0.0, 0.0]), ("velocity", [1.0, 1.0])))
+
+
+def bench_storage() -> None:
+    for count in SIZES:
+        for storage in ("dict", "archetype"):
+            world = make_world(storage)
+            seconds = timeit(lambda: populate(world, count), number=1)
+            report(f"{storage:<9} populate", count, seconds, 1)
+
+            loops = max(1, 100_000 // count)
+            for cids in (("position", "velocity"), ("dead", "position")):
+                label = ",".join(cids)
+                seconds = timeit(lambda: quary_components(world, cids), number=loops)
+                report(f"{storage:<9} {label}", count, seconds, loops)
+
+            seconds = timeit(lambda: churn(world, count), number=1)
+            report(f"{storage:<9} churn 10%", count, seconds, 1)
+
+
+SQUARE_COMPONENTS = (
+    "pos", "speed", "image", "boundary", "lifetime", "explode", "audio"
+)
+SHRAPNEL_COMPONENTS = ("pos", "speed", "image", "lifetime")
+
+
+def bench_churn() -> None:
+    """Spawn and despawn example_1 style squares and shrapnel"""
+
+    def spawn(world: WorldData, count: int) -> None:
+        for eid in range(1, count + 1):
+            cids = SQUARE_COMPONENTS if eid % 2 else SHRAPNEL_COMPONENTS
+            add_components(world, eid, tuple((cid, eid) for cid in cids))
+
+    def despawn_scan(world: WorldData, count: int) -> None:
+        for eid in range(1, count + 1):
+            scan_remove(world, eid)
+
+    def despawn_each(world: WorldData, count: int) -> None:
+        for eid in range(1, count + 1):
+            remove_entity(world, eid)
+
+    def despawn_bulk(world: WorldData, count: int) -> None:
+        remove_entities(world, range(1, count + 1))
+
+    for count in (10_000, 100_000):
+        for label, despawn in (
+            ("scan", despawn_scan),
+            ("signature", despawn_each),
+            ("bulk", despawn_bulk),
+        ):
+            world = make_world()
+            # Stores for other component types, which the scan probes too
+            for cid in range(64):
+                world['components'][f"unused_{cid}"] = {}
+
+            def cycle() -> None:
+                spawn(world, count)
+                despawn(world, count)
+
+            seconds = timeit(cycle, number=1)
+            rate = count / seconds
+            print(f"{label:<10} spawn+despawn {count:>8} entities {rate:>12,.0f} /s")
+
+
+BOUNDS = (1920.0, 1080.0)
+SQUARE = 16.0
+DT = 1 / 60
+
+
+def spawn_squares(world: WorldData, count: int) -> WorldData:
+    for eid in range(1, count + 1):
+        add_components(
+            world,
+            eid,
+            (
+                ("pos", [eid % BOUNDS[0], eid % BOUNDS[1]]),
+                ("speed", [100.0, -100.0]),
+                ("lifetime", 3.0 + eid % 3),
+            ),
+        )
+
+    return world
+
+
+def loop_frame(world: WorldData) -> None:
+    """example_1's per-object speed, boundary and lifetime systems"""
+    for components in quary_components(world, ("pos", "speed")).values():
+        pos, speed = components.values()
+        pos[0] += speed[0] * DT
+        pos[1] += speed[1] * DT
+
+    for components in quary_components(world, ("pos", "speed")).values():
+        pos, speed = components.values()
+        if not (0 < pos[0] < BOUNDS[0] - SQUARE):
+            speed[0] = -speed[0]
+        if not (0 < pos[1] < BOUNDS[1] - SQUARE):
+            speed[1] = -speed[1]
+
+    for eid, components in quary_components(world, ("lifetime",)).items():
+        lifetime = components["lifetime"] - DT
+        add_component(world, eid, "lifetime", lifetime)
+        if lifetime <= 0:
+            add_component(world, eid, "dead", True)
+
+
+def move_kernel(dt: float, pos, speed) -> None:
+    pos += speed * dt
+
+
+def bounce_kernel(dt: float, pos, speed) -> None:
+    out = (pos <= 0) | (pos >= np.subtract(BOUNDS, SQUARE))
+    speed[out] *= -1
+
+
+def lifetime_system(world: WorldData, events, game_state, dt: float) -> None:
+    expired = []
+    for eids, lifetime in quary_columns(world, ("lifetime",)):
+        lifetime -= dt
+        expired.extend(eids[row] for row in np.flatnonzero(lifetime <= 0))
+
+    for eid in expired:
+        add_component(world, eid, "dead", True)
+
+
+def bench_batch() -> None:
+    if np is None:
+        print("skipped, numpy is not installed")
+        return
+
+    systems = (
+        batch_system(("pos", "speed"), move_kernel),
+        batch_system(("pos", "speed"), bounce_kernel),
+        lifetime_system,
+    )
+
+    for count in SIZES:
+        loops = max(1, 100_000 // count)
+
+        world = spawn_squares(make_world(), count)
+        seconds = timeit(lambda: loop_frame(world), number=loops)
+        report("per-object frame", count, seconds, loops)
+
+        world = make_world("archetype")
+        declare_column(world, "pos", shape=(2,))
+        declare_column(world, "speed", shape=(2,))
+        declare_column(world, "lifetime")
+        spawn_squares(world, count)
+
+        def batch_frame() -> None:
+            for system in systems:
+                system(world, (), {}, DT)
+
+        seconds = timeit(batch_frame, number=loops)
+        report("vectorized frame", count, seconds, loops)
+
+
+def bench_spatial() -> None:
+    count = 10_000
+    world = make_world()
+    for eid in range(1, count + 1):
+        x, y = (eid * 7919) % BOUNDS[0], (eid * 104729) % BOUNDS[1]
+        add_components(
+            world,
+            eid,
+            (("position", [x, y]), ("size", [SQUARE, SQUARE]), ("collidable", True)),
+        )
+
+    def scan_overlaps(x: float, y: float, w: float, h: float) -> list[EntityID]:
+        found = []
+        for eid, components in quary_components(
+            world, ("position", "size", "collidable")
+        ).items():
+            position, size, _ = components.values()
+            if (
+                position[0] <= x + w
+                and x <= position[0] + size[0]
+                and position[1] <= y + h
+                and y <= position[1] + size[1]
+            ):
+                found.append(eid)
+
+        return found
+
+    probes = [
+        (*get_component(world, eid, "position"), SQUARE, SQUARE)
+        for eid in range(1, count + 1, count // 100)
+    ]
+
+    seconds = timeit(lambda: [scan_overlaps(*rect) for rect in probes], number=1)
+    report("scan  overlaps", count, seconds, len(probes))
+
+    seconds = timeit(lambda: enable_spatial(world, 64), number=1)
+    report("grid  build", count, seconds, 1)
+    for rect in probes:
+        assert sorted(scan_overlaps(*rect)) == sorted(
+            quary_rect(world, *rect, ("collidable",))
+        )
+    seconds = timeit(
+        lambda: [quary_rect(world, *rect, ("collidable",)) for rect in probes],
+        number=10,
+    )
+    report("grid  overlaps", count, seconds, 10 * len(probes))
+
+    for components in quary_components(world, ("position",)).values():
+        components["position"][0] += 1
+    seconds = timeit(lambda: spatial_system(world, (), None, DT), number=1)
+    report("grid  update after move", count, seconds, 1)
+
+    def frame() -> None:
+        spatial_system(world, (), None, DT)
+        for eid in range(1, count + 1):
+            quary_rect(world, *get_component(world, eid, "position"), SQUARE, SQUARE)
+
+    seconds = timeit(frame, number=1)
+    report("grid  all-pairs frame", count, seconds, 1)
+
+
+def bench_schedule() -> None:
+    if np is None:
+        print("skipped, numpy is not installed")
+        return
+
+    def smooth_kernel(dt: float, column) -> None:
+        for _ in range(20):
+            np.sqrt(column * column + dt, out=column)
+
+    count = 1_000_000
+    cids = ("heat", "mass", "charge", "spin")
+    world = make_world("archetype")
+    for cid in cids:
+        declare_column(world, cid)
+        world['systems'][cid] = batch_system((cid,), smooth_kernel)
+        declare_access(world, cid, writes=(cid,))
+    for eid in range(count):
+        add_components(world, eid, tuple((cid, 1.0) for cid in cids))
+
+    print(format_stages(get_schedule(world)))
+    seconds = timeit(lambda: run_systems(world, (), None, DT), number=5)
+    report("sequential frame", count, seconds, 5)
+    enable_parallel(world, len(cids))
+    seconds = timeit(lambda: run_systems(world, (), None, DT), number=5)
+    report("parallel frame", count, seconds, 5)
+    disable_parallel(world)
+
+
+def bench_profile() -> None:
+    """Overhead of the profiler on a frame of cheap systems"""
+
+    def noop_system(world: WorldData, events, game_state, dt: float) -> None:
+        pass
+
+    world = make_world()
+    for sid in range(10):
+        world['systems'][f"noop_{sid}"] = noop_system
+
+    loops = 100_000
+    for label, enable in (
+        ("disabled", disable_profiling),
+        ("enabled", enable_profiling),
+    ):
+        enable(world)
+        seconds = timeit(lambda: run_systems(world, (), None, DT), number=loops)
+        report(f"profiler {label}", 0, seconds, loops)
+
+
+def bench_signature() -> None:
+    """Per-entity match tests: string probes against one bitmask AND"""
+    cids = ("position", "velocity", "size")
+    for count in SIZES:
+        world = populate(make_world(), count)
+        emap, signatures = world['entities'], world['signatures']
+        mask = query_mask(world, cids)
+        loops = max(1, 100_000 // count)
+
+        def probe() -> int:
+            return sum(
+                all(cid in components for cid in cids)
+                for components in emap.values()
+            )
+
+        def bits() -> int:
+            return sum(signature & mask == mask for signature in signatures.values())
+
+        assert probe() == bits() == sum(has_components(world, eid, cids) for eid in emap)
+        seconds = timeit(probe, number=loops)
+        report("string probes", count, seconds, loops)
+        seconds = timeit(bits, number=loops)
+        report("signature mask", count, seconds, loops)
+
+
+def bench_render() -> None:
+    if pygame is None:
+        print("skipped, pygame is not installed")
+        return
+
+    screen = pygame.Surface((1920, 1080))
+    shrapnel = pygame.Surface((8, 8))
+    pygame.draw.circle(shrapnel, "yellow", (4, 4), 4)
+    shrapnel.set_colorkey("black")
+
+    def draw_entities(surface, world: WorldData) -> None:
+        """example_2's draw loop before batching"""
+        for components in quary_components(world, ("image", "position")).values():
+            image, pos = components.values()
+            surface.blit(image, pos)
+
+    for count in (5_000, 50_000):
+        world = make_world()
+        for eid in range(count):
+            x, y = (eid * 7919) % 2400 - 240, (eid * 104729) % 1300 - 110
+            position = pygame.Vector2(x, y)
+            add_components(world, eid, (("image", shrapnel), ("position", position)))
+
+        loops = max(1, 250_000 // count)
+        seconds = timeit(lambda: draw_entities(screen, world), number=loops)
+        report("blit per entity", count, seconds, loops)
+        seconds = timeit(lambda: draw_sprites(screen, world), number=loops)
+        report("batched sprites", count, seconds, loops)
+        viewport = pygame.Rect(0, 0, 960, 540)
+        seconds = timeit(lambda: draw_sprites(screen, world, viewport), number=loops)
+        report("batched sprites, culled", count, seconds, loops)
+
+
+def bench_prefab() -> None:
+    """Spawn example_1 style squares one by one and from a prefab"""
+    shared = (("boundary", BOUNDS), ("explode", True), ("audio", None))
+
+    def square(eid: int) -> dict[ComponentID, Component]:
+        return {
+            "pos": [eid % BOUNDS[0], eid % BOUNDS[1]],
+            "speed": [100.0, -100.0],
+            "image": eid % 16,
+            "lifetime": 3.0 + eid % 3,
+        }
+
+    def looped(world: WorldData, count: int) -> None:
+        for eid in range(count):
+            components = tuple(square(eid).items()) + shared
+            add_components(world, spawn_entity(world), components)
+
+    def bulk(world: WorldData, count: int) -> None:
+        instantiate(world, "square", overrides=[square(eid) for eid in range(count)])
+
+    for count in (10_000, 100_000):
+        for storage in ("dict", "archetype"):
+            for label, spawn in (("looped", looped), ("prefab", bulk)):
+                world = make_world(storage)
+                register_view(world, ("pos", "speed"))
+                register_view(world, ("pos", "dead", "explode", "audio"))
+                register_prefab(world, "square", shared, [cid for cid, _ in shared])
+                seconds = timeit(lambda: spawn(world, count), number=1)
+                report(f"{storage:<9} {label} spawn", count, seconds, 1)
+
+
+def bench_changes() -> None:
+    """Find the few flags flipped each frame by scanning, by change ticks
+    or from the events the flips emit"""
+
+    def flip(world: WorldData, eids: list[EntityID]) -> None:
+        for eid in eids[::RARE_EVERY]:
+            add_component(world, eid, "trigger", True)
+            emit(world, "triggered", eid)
+
+    def scan(world: WorldData, events, game_state, dt: float) -> None:
+        for components in quary_components(world, ("trigger", "collider")).values():
+            if components["trigger"]:
+                game_state["seen"] += 1
+
+    def changed(world: WorldData, events, game_state, dt: float) -> None:
+        for components in quary_components(
+            world,
+            ("trigger", "collider"),
+            changed=("trigger",),
+            since=last_run(world, "react"),
+        ).values():
+            if components["trigger"]:
+                game_state["seen"] += 1
+
+    def events(world: WorldData, events, game_state, dt: float) -> None:
+        for eid in read_events(world, "triggered", last_run(world, "react")):
+            if has_components(world, eid, ("collider",)):
+                game_state["seen"] += 1
+
+    for count in SIZES:
+        loops = max(1, 100_000 // count)
+        for label, react in (("scan", scan), ("changed", changed), ("events", events)):
+            world = create_world({"react": react}, [("trigger", "collider")])
+            track_changes(world, ("trigger",))
+            add_channel(world, "triggered", int)
+            register_prefab(world, "flag", (("trigger", False), ("collider", True)))
+            eids = instantiate(world, "flag", count)
+            game_state = {"seen": 0}
+
+            def frame() -> None:
+                flip(world, eids)
+                run_systems(world, (), game_state, DT)
+
+            # The first run sees every flag as changed
+            frame()
+            seconds = timeit(frame, number=loops)
+            report(f"{label:<8} reactive frame", count, seconds, loops)
+
+
+def bench_snapshot() -> None:
+    """Save and load a 100k-entity world of example_1 style squares"""
+    count = 100_000
+
+    def numeric_world(storage: Storage) -> WorldData:
+        world = make_world(storage)
+        if storage == "archetype" and np is not None:
+            declare_column(world, "pos", shape=(2,))
+            declare_column(world, "speed", shape=(2,))
+            declare_column(world, "lifetime")
+        return world
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "world.snapshot")
+        for storage in ("dict", "archetype"):
+            world = spawn_squares(numeric_world(storage), count)
+            seconds = timeit(lambda: save_snapshot(world, path), number=1)
+            megabytes = os.path.getsize(path) / 2**20
+            print(
+                f"{storage:<9} {'save':<9} {count:>8} entities"
+                f" {count / seconds:>12,.0f} /s"
+                f" {megabytes / seconds:>8.1f} MB/s ({megabytes:.1f} MB)"
+            )
+
+            for memory_map in (False, True):
+                loaded = numeric_world(storage)
+                seconds = timeit(
+                    lambda: load_snapshot(loaded, path, memory_map), number=1
+                )
+                label = "mmap load" if memory_map else "load"
+                print(
+                    f"{storage:<9} {label:<9} {count:>8} entities"
+                    f" {count / seconds:>12,.0f} /s {megabytes / seconds:>8.1f} MB/s"
+                )
+
+
+def bench_tuples() -> None:
+    """One movement pass over dicts per entity and over lazy tuples,
+    with allocations traced during a single pass"""
+
+    def dicts(world: WorldData) -> None:
+        for components in quary_components(world, ("position", "velocity")).values():
+            position, velocity = components.values()
+            position[0] += velocity[0] * DT
+            position[1] += velocity[1] * DT
+
+    def tuples(world: WorldData) -> None:
+        for position, velocity in quary_tuples(
+            world, ("position", "velocity"), False
+        ):
+            position[0] += velocity[0] * DT
+            position[1] += velocity[1] * DT
+
+    for count in SIZES:
+        loops = max(1, 100_000 // count)
+        for storage in ("dict", "archetype"):
+            world = populate(make_world(storage), count)
+            register_view(world, ("position", "velocity"))
+            for label, move in (("dicts", dicts), ("tuples", tuples)):
+                seconds = timeit(lambda: move(world), number=loops)
+                tracemalloc.start()
+                move(world)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                name = f"{storage:<9} {label:<6} {peak // 1024:>6} KiB peak"
+                report(name, count, seconds, loops)
+
+
+def bench_timers() -> None:
+    """Expire example_1 style lifetimes by ageing every entity each frame
+    and from a heap of deadlines"""
+
+    def age(world: WorldData, events, game_state, dt: float) -> None:
+        expired = []
+        for eid, lifetime in quary_tuples(world, ("lifetime",)):
+            lifetime[0] -= dt
+            if lifetime[0] <= 0:
+                expired.append(eid)
+
+        for eid in expired:
+            add_component(world, eid, "dead", True)
+
+    for count in SIZES:
+        loops = max(1, 100_000 // count)
+        rng = random.Random(SEED)
+        lifetimes = [rng.uniform(3, 6) for _ in range(count)]
+        for label in ("scan", "heap"):
+            world = create_world({"age": age} if label == "scan" else {})
+            for lifetime in lifetimes:
+                eid = spawn_entity(world)
+                if label == "scan":
+                    add_components(world, eid, (("lifetime", [lifetime]),))
+                else:
+                    add_components(world, eid, (("image", 0),))
+                    add_after(world, eid, lifetime, "dead")
+
+            seconds = timeit(lambda: run_systems(world, (), None, DT), number=loops)
+            report(f"{label:<8} expiry frame", count, seconds, loops)
+
+
+def bench_tags() -> None:
+    """Visit the rare enabled entities through a bool flag component and
+    through an enabled tag"""
+    for count in SIZES:
+        loops = max(1, 100_000 // count)
+        for storage in ("dict", "archetype"):
+            flags = populate(make_world(storage), count)
+            tags = populate(make_world(storage), count)
+            register_view(flags, ("position", "enabled"))
+            register_view(tags, ("position", "enabled"))
+            for eid in range(1, count + 1):
+                enabled = eid % RARE_EVERY == 0
+                add_component(flags, eid, "enabled", enabled)
+                if enabled:
+                    add_tags(tags, eid, ("enabled",))
+
+            def flagged() -> int:
+                rows = quary_tuples(flags, ("position", "enabled"), False)
+                return sum(1 for _, enabled in rows if enabled)
+
+            def tagged() -> int:
+                return sum(
+                    1 for _ in quary_tuples(tags, ("position",), with_=("enabled",))
+                )
+
+            assert flagged() == tagged()
+            for label, visit in (("flag", flagged), ("tag", tagged)):
+                seconds = timeit(visit, number=loops)
+                report(f"{storage:<9} {label:<4} enabled", count, seconds, loops)
+
+
+class Point:
+    def __init__(self, x: float, y: float) -> None:
+        self.x, self.y = x, y
+
+
+def bench_schema() -> None:
+    """Memory, snapshot time and snapshot size of 100k two-float
+    components as lists, plain objects, Vector2s and a schema type"""
+    count = 100_000
+    layouts = {"list": lambda x, y: [x, y], "object": Point}
+    if pygame is not None:
+        layouts["vector2"] = pygame.Vector2
+    layouts["schema"] = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "world.snapshot")
+        for label, make in layouts.items():
+            world = make_world()
+            if make is None:
+                make = declare_schema(world, "pos", {"x": float, "y": float})
+            tracemalloc.start()
+            values = [make(eid * 0.5, eid * 0.25) for eid in range(count)]
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            register_prefab(world, "point", ())
+            instantiate(world, "point", overrides=[{"pos": value} for value in values])
+            seconds = timeit(lambda: save_snapshot(world, path), number=1)
+            print(
+                f"{label:<9} {used / count:>6.1f} B/entity"
+                f" save {seconds * 1000:>7.1f} ms"
+                f" {os.path.getsize(path) / 2**20:>5.2f} MB"
+            )
+            if label == "schema":
+                packed = world_memory(world)['packed']['pos']
+                print(f"{'packed':<9} {packed / count:>6.1f} B/entity")
+
+
+def bench_conditions() -> None:
+    """A frame of eight idle event-driven systems and a sweep that only
+    needs 10 Hz, run every frame and behind run conditions"""
+
+    def reactor(sid: SystemID) -> System:
+        def react(world: WorldData, events, game_state, dt: float) -> None:
+            for eid in read_events(world, "alarm", last_run(world, sid)):
+                if has_components(world, eid, ("dead",)):
+                    game_state["seen"] += 1
+        return react
+
+    def sweep(world: WorldData, events, game_state, dt: float) -> None:
+        for position, velocity in quary_tuples(world, ("position", "velocity"), False):
+            position[0] += velocity[0] * dt
+            position[1] += velocity[1] * dt
+
+    sids = [f"react_{index}" for index in range(8)]
+    for count in SIZES:
+        # At least one 10 Hz period of 60 Hz frames
+        loops = max(6, 100_000 // count)
+        for label in ("always", "run_if"):
+            systems = {sid: reactor(sid) for sid in sids}
+            systems["sweep"] = sweep
+            world = populate(create_world(systems), count)
+            add_channel(world, "alarm", int)
+            if label == "run_if":
+                for sid in sids:
+                    run_if(world, sid, when_events("alarm"))
+                run_if(world, "sweep", at_rate(10))
+
+            game_state = {"seen": 0}
+            seconds = timeit(
+                lambda: run_systems(world, (), game_state, DT), number=loops
+            )
+            report(f"{label:<8} idle frame", count, seconds, loops)
+
+
+BENCHMARKS = {
+    "query": bench_query,
+    "views": bench_views,
+    "storage": bench_storage,
+    "batch": bench_batch,
+    "churn": bench_churn,
+    "spatial": bench_spatial,
+    "schedule": bench_schedule,
+    "profile": bench_profile,
+    "signature": bench_signature,
+    "render": bench_render,
+    "prefab": bench_prefab,
+    "changes": bench_changes,
+    "snapshot": bench_snapshot,
+    "tuples": bench_tuples,
+    "timers": bench_timers,
+    "tags": bench_tags,
+    "schema": bench_schema,
+    "conditions": bench_conditions,
+}
+
+
+SEED = 1234
+SCENARIO_FRAMES = 300
+SCENARIO_VIEWS = (
+    ("pos", "speed"),
+    ("pos", "dead", "explode"),
+    ("dead",),
+)
+
+
+def square(
+    rng: random.Random, explode: bool
+) -> tuple[tuple[ComponentID, Component], ...]:
+    components = (
+        ("pos", [rng.random() * BOUNDS[0], rng.random() * BOUNDS[1]]),
+        ("speed", [rng.uniform(-100, 100), rng.uniform(-100, 100)]),
+        ("image", rng.randrange(16)),
+    )
+    return components + (("explode", True),) if explode else components
+
+
+def shrapnel(
+    rng: random.Random, pos: list[float]
+) -> tuple[tuple[ComponentID, Component], ...]:
+    return (
+        ("pos", list(pos)),
+        ("speed", [rng.uniform(-500, 500), rng.uniform(-500, 500)]),
+        ("image", 0),
+    )
+
+
+def spawn_expiring(
+    world: WorldData,
+    components: tuple[tuple[ComponentID, Component], ...],
+    lifetime: float,
+) -> None:
+    """Spawns an entity that gets a dead component after lifetime"""
+    eid = spawn_entity(world)
+    add_components(world, eid, components)
+    add_after(world, eid, lifetime, "dead")
+
+
+def move_system(world: WorldData, events, game_state, dt: float) -> None:
+    moved = 0
+    for pos, speed in quary_tuples(world, ("pos", "speed"), False):
+        moved += 1
+        pos[0] += speed[0] * dt
+        pos[1] += speed[1] * dt
+        if not (0 < pos[0] < BOUNDS[0] - SQUARE):
+            speed[0] = -speed[0]
+        if not (0 < pos[1] < BOUNDS[1] - SQUARE):
+            speed[1] = -speed[1]
+    game_state["ops"] += moved
+
+
+def burst_system(world: WorldData, events, game_state, dt: float) -> None:
+    rng = game_state["rng"]
+    for components in quary_components(world, ("pos", "dead", "explode")).values():
+        for _ in range(5):
+            pieces = shrapnel(rng, components["pos"])
+            spawn_expiring(world, pieces, rng.uniform(0.1, 0.3))
+        game_state["ops"] += 5
+
+
+def reap_system(world: WorldData, events, game_state, dt: float) -> None:
+    dead = list(quary_components(world, ("dead",)))
+    remove_entities(world, dead)
+    game_state["ops"] += len(dead)
+
+
+def example_1_world() -> WorldData:
+    return create_world(
+        {
+            "move": move_system,
+            "burst": burst_system,
+            "reap": reap_system,
+        },
+        SCENARIO_VIEWS,
+    )
+
+
+def spawning(per_frame: int, explode: bool):
+    """example_1 with the mouse held down, spawning per_frame squares"""
+
+    def setup(rng: random.Random):
+        world = example_1_world()
+        game_state = {"rng": rng, "ops": 0}
+
+        def frame() -> int:
+            game_state["ops"] = per_frame
+            for _ in range(per_frame):
+                lifetime = rng.uniform(0.5, 1.5) if explode else rng.uniform(3, 6)
+                spawn_expiring(world, square(rng, explode), lifetime)
+            run_systems(world, (), game_state, DT)
+            return game_state["ops"]
+
+        return frame
+
+    return setup
+
+
+def transitions(levels: int = 100, entities: int = 1_000, resident: int = 8):
+    """example_2 jumping between random levels through the world manager,
+    with room for resident levels in memory"""
+
+    def setup(rng: random.Random):
+        def build(world: WorldData) -> None:
+            register_prefab(world, "square", (("image", 0),), ("image",))
+            instantiate(
+                world,
+                "square",
+                overrides=[
+                    {
+                        "pos": [rng.random() * BOUNDS[0], rng.random() * BOUNDS[1]],
+                        "speed": [rng.uniform(-100, 100), rng.uniform(-100, 100)],
+                    }
+                    for _ in range(entities)
+                ],
+            )
+
+        sample = example_1_world()
+        build(sample)
+        directory = tempfile.TemporaryDirectory()
+        manager = create_manager(
+            example_1_world,
+            directory.name,
+            resident * world_memory(sample)['total'],
+        )
+        for level in range(levels):
+            add_factory(manager, f"level_{level}", build)
+        game_state = {"rng": rng, "ops": 0, "directory": directory}
+
+        def frame() -> int:
+            world = switch_world(manager, f"level_{rng.randrange(levels)}")
+            game_state["ops"] = 0
+            run_systems(world, (), game_state, DT)
+            return game_state["ops"]
+
+        return frame
+
+    return setup
+
+
+SCENARIOS = {
+    "squares": spawning(20, explode=False),
+    "bursts": spawning(20, explode=True),
+    "transitions": transitions(),
+}
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(setup, frames: int = SCENARIO_FRAMES) -> dict[str, float]:
+    """Times every frame, then replays the same frames to trace memory"""
+    frame = setup(random.Random(SEED))
+    times, ops = [], 0
+    for _ in range(frames):
+        start = perf_counter()
+        ops += frame()
+        times.append(perf_counter() - start)
+
+    frame = setup(random.Random(SEED))
+    tracemalloc.start()
+    for _ in range(frames):
+        frame()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        "ops_per_sec": ops / sum(times),
+        "p50_ms": percentile(times, 0.50) * 1000,
+        "p95_ms": percentile(times, 0.95) * 1000,
+        "p99_ms": percentile(times, 0.99) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+# Metric -> whether a higher value is better
+METRICS = {
+    "ops_per_sec": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "peak_kib": False,
+}
+
+
+def regressions(
+    result: dict[str, float], baseline: dict[str, float], tolerance: float
+) -> list[str]:
+    flagged = []
+    for metric, higher_is_better in METRICS.items():
+        if metric not in baseline:
+            continue
+        change = result[metric] / baseline[metric] - 1
+        if (-change if higher_is_better else change) > tolerance:
+            flagged.append(f"{metric} {change:+.0%}")
+
+    return flagged
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", help="benchmarks and scenarios to run")
+    parser.add_argument("--save", metavar="FILE", help="save scenario results")
+    parser.add_argument("--baseline", metavar="FILE", help="compare to saved results")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results, failed = {}, False
+    for name in args.names or [*BENCHMARKS, *SCENARIOS]:
+        print(f"== {name}")
+        if name in BENCHMARKS:
+            BENCHMARKS[name]()
+            continue
+
+        result = results[name] = run_scenario(SCENARIOS[name])
+        print(
+            f"{result['ops_per_sec']:>12,.0f} ops/s"
+            f"  p50 {result['p50_ms']:.2f} ms  p95 {result['p95_ms']:.2f} ms"
+            f"  p99 {result['p99_ms']:.2f} ms  peak {result['peak_kib']:,.0f} KiB"
+        )
+        if name in baseline:
+            flagged = regressions(result, baseline[name], args.tolerance)
+            if flagged:
+                failed = True
+                print("REGRESSION", ", ".join(flagged))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
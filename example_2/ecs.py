@@ -1,20 +1,168 @@
-from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy as shallow_copy
+from functools import partial
+from itertools import chain, compress, repeat
+from threading import Lock
+from typing import Callable, Iterable, Iterator, Sequence
 from tp import *
+from assets import create_assets, intern_asset
+from events import add_channel, emit, read_events, swap_events
+from memory import format_memory, world_memory
+from profiler import (
+    begin_frame,
+    create_profiler,
+    dump_chrome_trace,
+    format_summary,
+    profile_span,
+)
+from registry import cids_mask, query_mask
+from schedule import build_stages, format_stages
+from schema import component_type, pack, unpack
+from ticks import create_ticks, prune, stamp, stamped_since
+from timestep import advance, create_timestep, lerp
+from timers import cancel, create_timers, drop_timers, pop_due, push_timer
+from spatial import create_grid, grid_move, grid_quary, grid_remove, grid_span
+from archetype import (
+    declare_column,
+    matching_tables,
+    table_columns,
+    table_get,
+    table_quary,
+    get_table,
+    table_extend,
+    table_remove,
+    table_rows,
+    table_set,
+    table_unset,
+)
+
+SPATIAL: Query = ("position", "size")
+# Entity ids from spawn_entity are generation << INDEX_BITS | index
+INDEX_BITS = 32
+INDEX_MASK = (1 << INDEX_BITS) - 1
+# Queries of a parallel stage update the stats from several threads
+_COUNTING = Lock()
+
+def create_world(
+    systems: SystemMap,
+    views: Iterable[Query] = (),
+    storage: Storage = 'dict',
+    assets: AssetStore | None = None,
+) -> WorldData:
+    """Builds an empty world; worlds can share one asset store"""
+    world: WorldData = {
+        'entities': {},
+        'components': {},
+        'systems': dict(systems),
+        'views': {},
+        'query_stats': {'hits': 0, 'misses': 0, 'matched': 0},
+        'storage': storage,
+        'tables': {},
+        'locations': {},
+        'columns': {},
+        'commands': [],
+        'spatial': None,
+        'access': {},
+        'schedule': {'systems': (), 'stages': []},
+        'executor': None,
+        'changes': 0,
+        'profiler': None,
+        'registry': {},
+        'query_masks': {},
+        'signatures': {},
+        'allocator': {'generations': [], 'free': []},
+        'assets': create_assets() if assets is None else assets,
+        'prefabs': {},
+        'tick': 1,
+        'last_run': {},
+        'tracked': {},
+        'events': {},
+        'observers': {'add': {}, 'remove': {}},
+        'codecs': {},
+        'timestep': None,
+        'previous': {},
+        'pending_events': [],
+        'timers': create_timers(),
+        'tags': {},
+        'schemas': {},
+        'conditions': {},
+        'run_states': {},
+    }
+    for cids in views:
+        register_view(world, cids)
+
+    return world
+
+def spawn_entity(world: WorldData) -> EntityID:
+    """Hands out a fresh id, reusing the index of a removed entity
+
+    Don't mix these ids with hand-numbered ones in the same world.
+    """
+    allocator = world['allocator']
+    if allocator['free']:
+        index = allocator['free'].pop()
+    else:
+        index = len(allocator['generations'])
+        allocator['generations'].append(0)
+
+    return allocator['generations'][index] << INDEX_BITS | index
+
+def entity_index(eid: EntityID) -> int:
+    return eid & INDEX_MASK
+
+def entity_generation(eid: EntityID) -> int:
+    return eid >> INDEX_BITS
+
+def is_stale(world: WorldData, eid: EntityID) -> bool:
+    """Whether eid is an allocated id whose entity was removed since"""
+    generations = world['allocator']['generations']
+    index = eid & INDEX_MASK
+    return index < len(generations) and generations[index] != eid >> INDEX_BITS
+
+def _release(world: WorldData, eid: EntityID) -> None:
+    allocator = world['allocator']
+    index = eid & INDEX_MASK
+    if index < len(allocator['generations']) and not is_stale(world, eid):
+        allocator['generations'][index] += 1
+        allocator['free'].append(index)
 
 def add_components(
     world: WorldData,
     eid: EntityID,
     components: tuple[tuple[ComponentID, Component], ...],
 ) -> None:
-    for cid, component in components:
-        if eid not in world['entities']:
-            world['entities'][eid] = {}
-        if cid not in world['components']:
-            world['components'][cid] = {}
+    if is_stale(world, eid):
+        raise KeyError(f"entity {eid} was removed, its handle is stale")
+
+    if world['storage'] == 'archetype':
+        added = table_set(world, eid, components)
+    else:
+        added = [
+            cid
+            for cid, component in components
+            if _dict_set(world, eid, cid, component)
+        ]
+
+    _attached(world, eid, [cid for cid, _ in components], added)
 
-        world['entities'][eid][cid] = component
-        world['components'][cid][eid] = component
+def _attached(
+    world: WorldData,
+    eid: EntityID,
+    changed: Sequence[ComponentID],
+    added: Sequence[ComponentID],
+) -> None:
+    """Indexes the cids just added to eid and stamps the changed ones"""
+    if added:
+        added_mask = cids_mask(world, added)
+        signatures = world['signatures']
+        signatures[eid] = signatures.get(eid, 0) | added_mask
+        world['changes'] += len(added)
+        _update_views(world, eid, added_mask)
 
+    if world['tracked']:
+        _stamp_changes(world, (eid,), changed, added)
+    if added and world['observers']['add']:
+        _notify(world, 'add', eid, cids_mask(world, added))
 
 def add_component(
     world: WorldData,
@@ -22,49 +170,1019 @@ def add_component(
     cid: ComponentID,
     component: Component,
 ) -> None:
+    add_components(world, eid, ((cid, component),))
+
+def _dict_set(
+    world: WorldData,
+    eid: EntityID,
+    cid: ComponentID,
+    component: Component,
+) -> bool:
     if eid not in world['entities']:
         world['entities'][eid] = {}
     if cid not in world['components']:
         world['components'][cid] = {}
 
+    added = cid not in world['entities'][eid]
     world['entities'][eid][cid] = component
     world['components'][cid][eid] = component
 
+    return added
+
+def remove_components(
+    world: WorldData, eid: EntityID, cids: Iterable[ComponentID]
+) -> None:
+    """Removes the components in cids from eid, and the tags among them"""
+    tags = world['tags']
+    if tags:
+        cids = tuple(cids)
+        tagged = [cid for cid in cids if cid in tags]
+        if tagged:
+            remove_tags(world, eid, tagged)
+            cids = tuple(cid for cid in cids if cid not in tags)
+
+    if world['observers']['remove']:
+        cids = tuple(cids)
+        mask = world['signatures'].get(eid, 0) & cids_mask(world, cids)
+        _notify(world, 'remove', eid, mask)
+
+    if world['storage'] == 'archetype':
+        if eid not in world['locations']:
+            return
+        removed = table_unset(world, eid, cids)
+    else:
+        components = world['entities'].get(eid, {})
+        removed = [cid for cid in cids if cid in components]
+        for cid in removed:
+            del components[cid]
+            del world['components'][cid][eid]
+
+    if removed:
+        _detached(world, eid, removed)
+
+def _detached(
+    world: WorldData, eid: EntityID, removed: Sequence[ComponentID]
+) -> None:
+    """Unindexes the cids just removed from eid"""
+    if world['tracked']:
+        _stamp_removed(world, eid, removed)
+
+    removed_mask = cids_mask(world, removed)
+    world['signatures'][eid] &= ~removed_mask
+    world['changes'] += len(removed)
+    for query, matched in world['views'].items():
+        if query_mask(world, query) & removed_mask:
+            matched.pop(eid, None)
+
+    if world['spatial'] is not None and eid not in world['views'][SPATIAL]:
+        grid_remove(world['spatial'], eid)
+
+def add_tags(world: WorldData, eid: EntityID, tags: Iterable[ComponentID]) -> None:
+    """Marks eid with tags, components without a value
+
+    Tags are kept as sets of entities. They match in views, quary_rect,
+    has_components and the with_ and without query filters like
+    components do, but have no value to get or return from a query.
+    """
+    if is_stale(world, eid):
+        raise KeyError(f"entity {eid} was removed, its handle is stale")
+
+    added = []
+    for tag in tags:
+        members = world['tags'].setdefault(tag, {})
+        if eid not in members:
+            members[eid] = None
+            added.append(tag)
+
+    _attached(world, eid, added, added)
+
+def remove_tags(world: WorldData, eid: EntityID, tags: Iterable[ComponentID]) -> None:
+    tags = tuple(tags)
+    if world['observers']['remove']:
+        mask = world['signatures'].get(eid, 0) & cids_mask(world, tags)
+        _notify(world, 'remove', eid, mask)
+
+    removed = [tag for tag in tags if eid in world['tags'].get(tag, ())]
+    for tag in removed:
+        del world['tags'][tag][eid]
+    if removed:
+        _detached(world, eid, removed)
+
+def declare_schema(
+    world: WorldData, cid: ComponentID, schema: Schema, name: str | None = None
+) -> type:
+    """Returns a slotted component type with the fields of schema for cid
+
+    Snapshots save cid packed, one array per field, and world_memory
+    reports its packed size next to the size of the objects.
+    """
+    if cid in world['columns']:
+        raise ValueError(f"{cid!r} is a NumPy column already")
+
+    cls = component_type(name or cid.title().replace("_", ""), schema)
+    world['schemas'][cid] = cls
+    world['codecs'][cid] = {
+        'encode': partial(pack, cls),
+        'decode': partial(unpack, cls),
+    }
+    return cls
+
+def register_prefab(
+    world: WorldData,
+    name: str,
+    components: tuple[tuple[ComponentID, Component], ...],
+    shared: Iterable[ComponentID] = (),
+) -> None:
+    """Stores components to spawn with instantiate
+
+    Instances get their own copy of each component, made with its copy
+    method or copy.copy, except for those in shared, like images and
+    sounds, which they all reference.
+    """
+    prefab = dict(components)
+    shared = frozenset(shared)
+    if not shared <= prefab.keys():
+        raise ValueError(f"shared {sorted(shared - prefab.keys())} not in {name!r}")
+    world['prefabs'][name] = {'components': prefab, 'shared': shared}
+
+def instantiate(
+    world: WorldData,
+    name: str,
+    count: int | None = None,
+    overrides: Sequence[Prefab] = (),
+) -> list[EntityID]:
+    """Spawns count entities from a prefab, storing and indexing them in bulk
+
+    overrides[i] replaces or adds components of the i-th entity; count
+    defaults to one entity per override. Prefab components that aren't
+    overridden are copied per instance unless register_prefab shares them.
+    """
+    prefab = world['prefabs'][name]['components']
+    shared = world['prefabs'][name]['shared']
+    if count is None:
+        count = len(overrides) or 1
+    if len(overrides) > count:
+        raise ValueError(f"{len(overrides)} overrides for {count} entities")
+
+    cids = frozenset(prefab)
+    copied = [cid for cid in prefab if cid not in shared]
+    groups: dict[frozenset[ComponentID], tuple[list, list]] = {}
+    eids = [spawn_entity(world) for _ in range(count)]
+    for index, eid in enumerate(eids):
+        override = overrides[index] if index < len(overrides) else {}
+        row = prefab
+        if copied or override:
+            fresh = {cid: _fresh(prefab[cid]) for cid in copied if cid not in override}
+            row = {**prefab, **fresh, **override}
+        key = cids if len(row) == len(cids) else frozenset(row)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ([], [])
+        group[0].append(eid)
+        group[1].append(row)
+
+    for key, (group_eids, rows) in groups.items():
+        add_entities(
+            world, group_eids, {cid: [row[cid] for row in rows] for cid in key}
+        )
+
+    return eids
+
+def _fresh(component: Component) -> Component:
+    copy = getattr(component, 'copy', None)
+    return shallow_copy(component) if copy is None else copy()
+
+def add_entities(
+    world: WorldData,
+    eids: Sequence[EntityID],
+    columns: dict[ComponentID, Sequence[Component]],
+) -> None:
+    """Stores entities that have no components yet, all with the same
+    components, given as one column of values per cid"""
+    cids = frozenset(columns)
+    if world['storage'] == 'archetype':
+        table_extend(world, get_table(world, cids), eids, columns)
+    else:
+        world['entities'].update(
+            zip(eids, (dict(zip(columns, values)) for values in zip(*columns.values())))
+        )
+        cmap = world['components']
+        for cid, values in columns.items():
+            if cid not in cmap:
+                cmap[cid] = {}
+            cmap[cid].update(zip(eids, values))
+
+    if world['tracked']:
+        _stamp_changes(world, eids, cids, cids)
+
+    mask = cids_mask(world, cids)
+    world['signatures'].update(dict.fromkeys(eids, mask))
+    world['changes'] += len(eids) * len(cids)
+    for query, matched in world['views'].items():
+        query_bits = query_mask(world, query)
+        if query_bits & mask and mask & query_bits == query_bits:
+            matched.update(dict.fromkeys(eids))
+
+    if world['observers']['add']:
+        for eid in eids:
+            _notify(world, 'add', eid, mask)
+
+def observe(
+    world: WorldData, kind: str, cid: ComponentID, observer: Observer
+) -> None:
+    """Calls observer(world, eid, cid) after cid is added to an entity, for
+    kind 'add', or before it is removed, for kind 'remove'
+
+    Observers run in the middle of structural changes, so they should
+    defer their own.
+    """
+    world['observers'][kind].setdefault(cid, []).append(observer)
+
+def _notify(world: WorldData, kind: str, eid: EntityID, mask: int) -> None:
+    registry = world['registry']
+    for cid, observers in world['observers'][kind].items():
+        index = registry.get(cid)
+        if index is not None and mask >> index & 1:
+            for observer in observers:
+                observer(world, eid, cid)
+
+def get_component(world: WorldData, eid: EntityID, cid: ComponentID) -> Component:
+    if world['storage'] == 'archetype':
+        return table_get(world, eid, cid)
+    return world['entities'][eid][cid]
+
+def has_components(world: WorldData, eid: EntityID, cids: Query) -> bool:
+    mask = query_mask(world, cids)
+    return world['signatures'].get(eid, 0) & mask == mask
+
 def remove_entity(
     world: WorldData,
     eid: EntityID,
 ) -> None:
+    remove_entities(world, (eid,))
+
+def remove_entities(world: WorldData, eids: Iterable[EntityID]) -> None:
+    """Removes entities touching only the stores each of them is in"""
     emap, cmap = world.get('entities', {}), world.get('components', {})
-    if eid in emap:
-        del emap[eid]
+    locations = world.get('locations', {})
+
+    tracked, tags = world.get('tracked'), world.get('tags')
+    observed = world.get('observers', {}).get('remove')
 
-        for cid, entities in cmap.items():
-            if eid in entities:
+    removed = []
+    for eid in eids:
+        if observed and eid in world['signatures']:
+            _notify(world, 'remove', eid, world['signatures'][eid])
+        if eid in emap:
+            cids = emap.pop(eid)
+            for cid in cids:
                 del cmap[cid][eid]
+        elif eid in locations:
+            cids = table_remove(world, eid)
+        elif eid in world['signatures']:
+            cids = ()
+        else:
+            continue
+        if tags:
+            tagged = [tag for tag, members in tags.items() if eid in members]
+            for tag in tagged:
+                del tags[tag][eid]
+            cids = (*cids, *tagged)
+        if tracked:
+            _stamp_removed(world, eid, cids)
+        del world['signatures'][eid]
+        _release(world, eid)
+        removed.append(eid)
+
+    world['changes'] += len(removed)
+    for matched in world.get('views', {}).values():
+        for eid in removed:
+            matched.pop(eid, None)
+
+    if world.get('spatial') is not None:
+        for eid in removed:
+            grid_remove(world['spatial'], eid)
+
+def track_changes(world: WorldData, cids: Iterable[ComponentID]) -> None:
+    """Records when cids are added to, changed on or removed from entities
+
+    Components an entity already has count as added and changed now.
+    Changes are stamped by add_component(s); call mark_changed after
+    mutating a component in place.
+    """
+    for cid in cids:
+        if cid not in world['tracked']:
+            world['tracked'][cid] = create_ticks()
+            eids = list(_match(world, (cid,)))
+            _stamp_changes(world, eids, (cid,), (cid,))
+
+def mark_changed(world: WorldData, eid: EntityID, cid: ComponentID) -> None:
+    if cid in world['tracked']:
+        stamp(world['tracked'][cid]['changed'], eid, world['tick'])
+
+def _stamp_changes(
+    world: WorldData,
+    eids: Iterable[EntityID],
+    changed: Iterable[ComponentID],
+    added: Iterable[ComponentID],
+) -> None:
+    tracked, tick = world['tracked'], world['tick']
+    for cid in added:
+        if cid in tracked:
+            records = tracked[cid]
+            for eid in eids:
+                records['removed'].pop(eid, None)
+                stamp(records['added'], eid, tick)
+
+    for cid in changed:
+        if cid in tracked:
+            records = tracked[cid]['changed']
+            for eid in eids:
+                stamp(records, eid, tick)
+
+def _stamp_removed(
+    world: WorldData, eid: EntityID, cids: Iterable[ComponentID]
+) -> None:
+    tracked, tick = world['tracked'], world['tick']
+    for cid in cids:
+        if cid in tracked:
+            records = tracked[cid]
+            records['added'].pop(eid, None)
+            records['changed'].pop(eid, None)
+            stamp(records['removed'], eid, tick)
+
+def _tracked(world: WorldData, cid: ComponentID) -> ChangeTicks:
+    if cid not in world['tracked']:
+        raise ValueError(f"{cid!r} is not tracked, call track_changes first")
+    return world['tracked'][cid]
+
+def last_run(world: WorldData, sid: SystemID) -> int:
+    """The tick sid last ran at, 0 before its first run
+
+    Pass it as since to see what changed after sid's previous run.
+    """
+    return world['last_run'].get(sid, 0)
+
+def _changed_since(
+    world: WorldData, cids: Query, added: Query, changed: Query, since: int
+) -> list[EntityID]:
+    candidates = None
+    for kind, filter_cids in (('added', added), ('changed', changed)):
+        for cid in filter_cids:
+            found = stamped_since(_tracked(world, cid)[kind], since)
+            if candidates is None:
+                candidates = found
+            else:
+                found = set(found)
+                candidates = [eid for eid in candidates if eid in found]
+
+    mask, signatures = query_mask(world, cids), world['signatures']
+    return [eid for eid in candidates if signatures.get(eid, 0) & mask == mask]
+
+def quary_removed(world: WorldData, cid: ComponentID, since: int) -> list[EntityID]:
+    """Entities that lost cid, or were removed, after since"""
+    return stamped_since(_tracked(world, cid)['removed'], since)
+
+def register_view(world: WorldData, cids: Query) -> dict[EntityID, None]:
+    """Keeps the entities matching cids up to date as components change"""
+    views = world.setdefault('views', {})
+    if cids not in views:
+        views[cids] = dict.fromkeys(_match(world, cids))
+
+    return views[cids]
+
+def _update_views(world: WorldData, eid: EntityID, added_mask: int) -> None:
+    signature = world['signatures'][eid]
+    for cids, matched in world['views'].items():
+        mask = query_mask(world, cids)
+        if mask & added_mask and signature & mask == mask:
+            matched[eid] = None
+
+def _match(world: WorldData, cids: Query) -> Iterable[EntityID]:
+    tags = world.get('tags', {})
+    if world['storage'] == 'archetype':
+        components = tuple(cid for cid in cids if cid not in tags)
+        if len(components) == len(cids):
+            return [
+                eid
+                for table in matching_tables(world, components)
+                for eid in table['eids']
+            ]
+
+        # Tags aren't part of table signatures, so check them per entity
+        if components:
+            candidates = _match(world, components)
+        else:
+            candidates = min((tags[cid] for cid in cids), key=len)
+        mask, signatures = query_mask(world, cids), world['signatures']
+        return [eid for eid in candidates if signatures[eid] & mask == mask]
+
+    emap, cmap = world.get('entities', {}), world.get('components', {})
+    if not cids:
+        return emap.keys()
+
+    stores = []
+    for cid in cids:
+        store = tags[cid] if cid in tags else cmap.get(cid)
+        if store is None:
+            return ()
+        stores.append(store)
+
+    smallest = min(stores, key=len)
+    matched = smallest.keys()
+    for store in stores:
+        if store is not smallest:
+            matched = matched & store.keys()
+
+    return [eid for eid in smallest if eid in matched]
 
 def quary_components(
-    world: WorldData, cids: tuple[ComponentID, ...]
+    world: WorldData,
+    cids: Query,
+    added: Query = (),
+    changed: Query = (),
+    since: int = 0,
+    with_: Query = (),
+    without: Query = (),
+    optional: Query = (),
 ) -> dict[EntityID, dict[ComponentID, Component]]:
-    emap = world.get('entities', {})
+    """Answers from a registered view, the matching archetype tables or by
+    walking the rarest component store
+
+    With added or changed, only entities whose components listed there
+    were added or changed after the tick since are returned. They are
+    read from the change records instead of matching every entity.
+
+    Entities must also have the components or tags in with_ and none of
+    those in without, neither of which is returned. optional components
+    are returned when the entity has them and are None otherwise.
+    """
+    _check_valued(world, cids, optional)
+    if (
+        world['storage'] == 'archetype'
+        and not (added or changed or with_ or without or optional)
+        and cids not in world.get('views', {})
+    ):
+        _count(world, 'misses')
+        quary = table_quary(world, cids)
+        _count(world, 'matched', len(quary))
+        return quary
+
+    matched = _matched(world, cids + with_, added, changed, since, without)
     quary = {}
-    comp_count = len(cids)
+    if not (cids or optional):
+        quary = {eid: {} for eid in matched}
+    elif world['storage'] == 'archetype':
+        locations = world['locations']
+        for eid in matched:
+            table, row = locations[eid]
+            columns = table['columns']
+            quary[eid] = {cid: columns[cid][row] for cid in cids}
+            for cid in optional:
+                quary[eid][cid] = columns[cid][row] if cid in columns else None
+    else:
+        emap = world['entities']
+        for eid in matched:
+            components = emap[eid]
+            quary[eid] = {cid: components[cid] for cid in cids}
+            for cid in optional:
+                quary[eid][cid] = components.get(cid)
+
+    _count(world, 'matched', len(quary))
+    return quary
+
+def _count(world: WorldData, stat: str, amount: int = 1) -> None:
+    with _COUNTING:
+        world['query_stats'][stat] += amount
+
+def _check_valued(world: WorldData, cids: Query, optional: Query) -> None:
+    """Raises ValueError for tags among the components a query returns"""
+    tags = world['tags']
+    if tags:
+        tagged = [cid for cid in (*cids, *optional) if cid in tags]
+        if tagged:
+            raise ValueError(
+                "tags have no value to return, filter on"
+                f" {', '.join(map(repr, tagged))} with with_ or without"
+            )
+
+def _matched(
+    world: WorldData,
+    cids: Query,
+    added: Query,
+    changed: Query,
+    since: int,
+    without: Query = (),
+) -> Iterable[EntityID]:
+    views = world.get('views', {})
+    if added or changed:
+        _count(world, 'hits')
+        matched = _changed_since(world, cids, added, changed, since)
+    elif cids in views:
+        _count(world, 'hits')
+        matched = views[cids]
+    else:
+        _count(world, 'misses')
+        matched = _match(world, cids)
+
+    if not without:
+        return matched
+    mask, signatures = query_mask(world, without), world['signatures']
+    return [eid for eid in matched if not signatures[eid] & mask]
+
+def quary_tuples(
+    world: WorldData,
+    cids: Query,
+    with_eid: bool = True,
+    added: Query = (),
+    changed: Query = (),
+    since: int = 0,
+    with_: Query = (),
+    without: Query = (),
+    optional: Query = (),
+) -> Iterator[tuple]:
+    """Lazily yields (eid, c1, c2, ...) per match, or (c1, c2, ...)
+    without with_eid, with the components in the order of cids followed
+    by those of optional
+
+    Filters work as in quary_components. Only the tuples themselves are
+    built. The matches are fixed when this is called, but structural
+    changes while iterating must be deferred, since removed entities
+    would still be looked up.
+    """
+    _check_valued(world, cids, optional)
+    required = cids + with_
+    tags = world['tags']
+    if (
+        world['storage'] == 'archetype'
+        and not (added or changed)
+        and not any(cid in tags for cid in required)
+    ):
+        # Tables are scanned directly, even when a view exists
+        _count(world, 'misses')
+        excluded = cids_mask(world, [cid for cid in without if cid not in tags])
+        tagged = cids_mask(world, [cid for cid in without if cid in tags])
+        signatures = world['signatures']
+        untagged = lambda eid: not signatures[eid] & tagged
+        rows = []
+        matched = 0
+        for table in matching_tables(world, required):
+            if table['signature'] & excluded:
+                continue
+            matched += len(table['eids'])
+            table_iter = table_rows(table, cids, with_eid, optional)
+            if tagged:
+                # Tags aren't part of table signatures, so check them per row
+                table_iter = compress(table_iter, map(untagged, table['eids']))
+            rows.append(table_iter)
+        _count(world, 'matched', matched)
+        return chain.from_iterable(rows)
+
+    eids = tuple(_matched(world, required, added, changed, since, without))
+    _count(world, 'matched', len(eids))
+    if not eids:
+        return iter(())
+    if not (cids or optional):
+        # Entities with only tags have no row to read from
+        return zip(eids) if with_eid else repeat((), len(eids))
+    if world['storage'] == 'archetype':
+        return _located_rows(world, eids, cids, with_eid, optional)
+
+    cmap = world['components']
+    columns = [map(cmap[cid].__getitem__, eids) for cid in cids]
+    columns += [map(cmap.get(cid, {}).get, eids) for cid in optional]
+    return zip(eids, *columns) if with_eid else zip(*columns)
+
+def _located_rows(
+    world: WorldData,
+    eids: tuple[EntityID, ...],
+    cids: Query,
+    with_eid: bool,
+    optional: Query,
+) -> Iterator[tuple]:
+    locations = world['locations']
+    for eid in eids:
+        table, row = locations[eid]
+        columns = table['columns']
+        values = (
+            *(columns[cid][row] for cid in cids),
+            *(columns[cid][row] if cid in columns else None for cid in optional),
+        )
+        yield (eid, *values) if with_eid else values
+
+def enable_spatial(world: WorldData, cell_size: float = 128) -> None:
+    """Indexes entities with a position and size in a uniform grid
+
+    The grid is brought up to date by spatial_system, which should run
+    after the systems that move entities.
+    """
+    world['spatial'] = create_grid(cell_size)
+    register_view(world, SPATIAL)
+    spatial_system(world, (), None, 0)
+
+def spatial_system(
+    world: WorldData, events: Iterable[object], game_state, dt: float
+) -> None:
+    grid = world['spatial']
+    for eid, position, size in quary_tuples(world, SPATIAL):
+        span = grid_span(grid, position[0], position[1], size[0], size[1])
+        grid_move(grid, eid, span)
+
+def quary_rect(
+    world: WorldData,
+    x: float,
+    y: float,
+    w: float,
+    h: float,
+    cids: Query = (),
+) -> list[EntityID]:
+    """Entities with all cids whose box overlaps the rectangle"""
+    grid, signatures = world['spatial'], world['signatures']
+    mask = query_mask(world, cids)
+    found = []
+    for eid in grid_quary(grid, grid_span(grid, x, y, w, h)):
+        if signatures[eid] & mask != mask:
+            continue
+
+        position = get_component(world, eid, "position")
+        size = get_component(world, eid, "size")
+        if (
+            position[0] <= x + w
+            and x <= position[0] + size[0]
+            and position[1] <= y + h
+            and y <= position[1] + size[1]
+        ):
+            found.append(eid)
+
+    return found
+
+def defer_spawn(
+    world: WorldData, components: tuple[tuple[ComponentID, Component], ...]
+) -> EntityID:
+    """Allocates an id now and adds its components at the next flush"""
+    eid = spawn_entity(world)
+    world['commands'].append(('add', eid, components))
+    return eid
+
+def defer_add(
+    world: WorldData,
+    eid: EntityID,
+    components: tuple[tuple[ComponentID, Component], ...],
+) -> None:
+    world['commands'].append(('add', eid, components))
+
+def defer_add_tags(
+    world: WorldData, eid: EntityID, tags: tuple[ComponentID, ...]
+) -> None:
+    world['commands'].append(('tag', eid, tags))
+
+def defer_remove(
+    world: WorldData, eid: EntityID, cids: tuple[ComponentID, ...]
+) -> None:
+    world['commands'].append(('remove', eid, cids))
+
+def defer_despawn(world: WorldData, eid: EntityID) -> None:
+    world['commands'].append(('despawn', eid, ()))
+
+def flush_commands(world: WorldData) -> None:
+    """Applies queued structural changes in order
+
+    Runs of despawns are applied together through remove_entities.
+    Commands for entities removed in the meantime are dropped.
+    """
+    commands, world['commands'] = world['commands'], []
+    despawns = []
+    for kind, eid, payload in commands:
+        if kind == 'despawn':
+            despawns.append(eid)
+            continue
+        if despawns:
+            remove_entities(world, despawns)
+            despawns = []
+        if is_stale(world, eid):
+            continue
+
+        if kind == 'add':
+            add_components(world, eid, payload)
+        elif kind == 'tag':
+            add_tags(world, eid, payload)
+        else:
+            remove_components(world, eid, payload)
+
+    if despawns:
+        remove_entities(world, despawns)
+
+def quary_columns(world: WorldData, cids: Query) -> Iterator[tuple]:
+    """Yields (eids, column, ...) per archetype table holding all cids"""
+    if world['storage'] != 'archetype':
+        raise ValueError("column queries need archetype storage")
+    return table_columns(world, cids)
+
+def batch_system(cids: Query, kernel: Callable[..., None]) -> System:
+    """Wraps kernel(dt, column, ...) into a system run once per table"""
+    def system(
+        world: WorldData, events: Iterable[object], game_state, dt: float
+    ) -> None:
+        for _, *columns in quary_columns(world, cids):
+            kernel(dt, *columns)
+
+    return system
+
+def declare_access(
+    world: WorldData,
+    sid: SystemID,
+    reads: Iterable[ComponentID] = (),
+    writes: Iterable[ComponentID] = (),
+) -> None:
+    """Lets sid share a stage with systems it has no conflicting access with
 
-    temp = {}
-    for eid, components in emap.items():
-        temp = {}
+    Systems in a shared stage must defer their structural changes.
+    """
+    world['access'][sid] = {'reads': frozenset(reads), 'writes': frozenset(writes)}
+    world['schedule'] = {'systems': (), 'stages': []}
 
+def enable_parallel(world: WorldData, workers: int | None = None) -> None:
+    """Runs systems that share a stage on a thread pool"""
+    world['executor'] = ThreadPoolExecutor(workers, thread_name_prefix="ecs")
+
+def disable_parallel(world: WorldData) -> None:
+    if world['executor'] is not None:
+        world['executor'].shutdown()
+    world['executor'] = None
+
+def get_schedule(world: WorldData) -> list[list[SystemID]]:
+    """The stages run_systems runs, rebuilt when the systems change"""
+    sids = tuple(world['systems'])
+    if world['schedule']['systems'] != sids:
+        world['schedule'] = {
+            'systems': sids,
+            'stages': build_stages(world['systems'], world['access']),
+        }
+
+    return world['schedule']['stages']
+
+def enable_profiling(world: WorldData, capacity: int = 600) -> None:
+    """Times every system run in a ring buffer of the last capacity frames"""
+    world['profiler'] = create_profiler(capacity)
+
+def disable_profiling(world: WorldData) -> None:
+    world['profiler'] = None
+
+def run_if(world: WorldData, sid: SystemID, *conditions: Condition) -> None:
+    """Skips sid on frames where any of its conditions is false
+
+    A skipped system doesn't count as run: its next run gets the dt of
+    every frame since the last one, and last_run still points there.
+    """
+    world['conditions'].setdefault(sid, []).extend(conditions)
+    world['run_states'].setdefault(sid, {'elapsed': 0.0, 'frames': 0})
+
+def when_matched(cids: Query) -> Condition:
+    """Runs while some entity has cids, checked on a view of cids"""
+    def condition(world: WorldData, sid: SystemID, state: RunState) -> bool:
+        return bool(register_view(world, cids))
+    return condition
+
+def when_changed(*cids: ComponentID) -> Condition:
+    """Runs when any of the tracked cids was added or changed since"""
+    def condition(world: WorldData, sid: SystemID, state: RunState) -> bool:
+        since = last_run(world, sid)
         for cid in cids:
-            if cid in components:
-                temp[cid] = components[cid]
+            records = _tracked(world, cid)
+            for kind in ('added', 'changed'):
+                # Records are in tick order, so the newest is last
+                if next(reversed(records[kind].values()), 0) > since:
+                    return True
+        return False
+    return condition
 
-        if len(temp) == comp_count:
-            quary[eid] = {}
-            quary[eid] = temp
+def when_events(name: str) -> Condition:
+    """Runs when the channel name got events since the system's last run"""
+    def condition(world: WorldData, sid: SystemID, state: RunState) -> bool:
+        channel = world['events'][name]
+        newest = channel['current'] or channel['previous']
+        return bool(newest) and newest[-1][0] > last_run(world, sid)
+    return condition
 
-    return quary
+def every_frames(frames: int) -> Condition:
+    """Runs on every frames-th frame"""
+    def condition(world: WorldData, sid: SystemID, state: RunState) -> bool:
+        return state['frames'] >= frames
+    return condition
+
+def at_rate(hz: float) -> Condition:
+    """Runs at most hz times a second of dt"""
+    def condition(world: WorldData, sid: SystemID, state: RunState) -> bool:
+        # Summed dts can fall a hair short of an exact multiple
+        return state['elapsed'] >= 1 / hz - 1e-9
+    return condition
+
+def _due(world: WorldData, sid: SystemID, dt: float) -> float | None:
+    """The dt to run sid with this frame, None if a condition skips it"""
+    conditions = world['conditions'].get(sid)
+    if not conditions:
+        return dt
+
+    state = world['run_states'][sid]
+    state['elapsed'] += dt
+    state['frames'] += 1
+    for condition in conditions:
+        if not condition(world, sid, state):
+            return None
+
+    elapsed = state['elapsed']
+    state['elapsed'], state['frames'] = 0.0, 0
+    return elapsed
+
+def _run_system(
+    world: WorldData, sid: SystemID, events: Iterable[object], game_state, dt: float
+) -> None:
+    tick = world['tick']
+    if world['profiler'] is None:
+        world['systems'][sid](world, events, game_state, dt)
+    else:
+        with profile_span(world, sid):
+            world['systems'][sid](world, events, game_state, dt)
+    world['last_run'][sid] = tick
 
 def run_systems(
     world:WorldData, events:Iterable[object], game_state, dt: float
 ) -> None:
-    for system in world['systems'].values():
-        system(world, events, game_state, dt)
\ No newline at end of file
+    """Runs the schedule stage by stage, flushing deferred commands after
+    each stage; stages run in parallel once enable_parallel was called
+
+    Every stage and its flush share one tick, so a system doesn't see its
+    own changes on its next run. Systems whose run_if conditions fail are
+    skipped.
+    """
+    if world['profiler'] is not None:
+        begin_frame(world['profiler'])
+    _step(world, events, game_state, dt)
+
+def _step(
+    world: WorldData, events: Iterable[object], game_state, dt: float
+) -> None:
+    """run_systems without starting a profiler frame"""
+    executor = world['executor']
+    if world['events']:
+        swap_events(world)
+    if world['timers']['heap']:
+        with profile_span(world, "timers"):
+            _expire_timers(world, dt)
+    else:
+        world['timers']['time'] += dt
+
+    if world['tracked']:
+        # Removals every system has seen are dropped
+        oldest = min((last_run(world, sid) for sid in world['systems']), default=0)
+        for records in world['tracked'].values():
+            prune(records['removed'], oldest)
+
+    for stage in get_schedule(world):
+        if executor is None or len(stage) == 1:
+            for sid in stage:
+                due = _due(world, sid, dt)
+                if due is not None:
+                    _run_system(world, sid, events, game_state, due)
+        else:
+            # Conditions are checked up front, not on the worker threads
+            due = [(sid, _due(world, sid, dt)) for sid in stage]
+            futures = [
+                executor.submit(_run_system, world, sid, events, game_state, sid_dt)
+                for sid, sid_dt in due
+                if sid_dt is not None
+            ]
+            for future in futures:
+                future.result()
+
+        if world['commands']:
+            with profile_span(world, "flush"):
+                flush_commands(world)
+        world['tick'] += 1
+
+def enable_fixed_step(
+    world: WorldData,
+    step: float = 1 / 60,
+    max_steps: int = 5,
+    interpolate: Iterable[ComponentID] = (),
+) -> None:
+    """Makes run_fixed step the systems by exactly step seconds
+
+    The values of the interpolate components before the last step of a
+    frame are kept for interpolated; they must support + - and * float.
+    """
+    world['timestep'] = create_timestep(step, max_steps)
+    world['previous'] = {cid: {} for cid in interpolate}
+
+def run_fixed(
+    world: WorldData, events: Iterable[object], game_state, frame_time: float
+) -> int:
+    """Runs the systems as many fixed steps as frame_time makes up
+
+    Events are handed to the first step; when a frame runs no step they
+    wait for the next one. Returns the number of steps run. The profiler
+    counts the whole call as one frame, however many steps it runs.
+    """
+    if world['profiler'] is not None:
+        begin_frame(world['profiler'])
+    timestep = world['timestep']
+    world['pending_events'].extend(events)
+    steps = advance(timestep, frame_time)
+    for index in range(steps):
+        if index == steps - 1 and world['previous']:
+            _keep_previous(world)
+        events, world['pending_events'] = world['pending_events'], []
+        _step(world, events, game_state, timestep['step'])
+
+    return steps
+
+def _keep_previous(world: WorldData) -> None:
+    for cid, previous in world['previous'].items():
+        previous.clear()
+        for eid, component in quary_tuples(world, (cid,)):
+            copy = getattr(component, 'copy', None)
+            previous[eid] = component if copy is None else copy()
+
+def interpolated(world: WorldData, eid: EntityID, cid: ComponentID) -> Component:
+    """cid of eid between its last two fixed steps, for rendering"""
+    current = get_component(world, eid, cid)
+    previous = world['previous'].get(cid, {}).get(eid)
+    if previous is None:
+        return current
+    return lerp(previous, current, world['timestep']['alpha'])
+
+def despawn_after(world: WorldData, eid: EntityID, delay: float) -> TimerID:
+    """Removes eid delay simulation seconds from now"""
+    return push_timer(world['timers'], delay, eid, None, None)
+
+def add_after(
+    world: WorldData,
+    eid: EntityID,
+    delay: float,
+    cid: ComponentID,
+    component: Component = True,
+) -> TimerID:
+    """Adds cid to eid delay simulation seconds from now"""
+    return push_timer(world['timers'], delay, eid, cid, component)
+
+def cancel_timer(world: WorldData, timer: TimerID) -> None:
+    cancel(world['timers'], timer)
+
+def _expire_timers(world: WorldData, dt: float) -> None:
+    """Applies the timers due by the end of this frame's dt
+
+    Timers of entities that were removed in the meantime are dropped.
+    Runs before the systems, so they see the expired entities this frame.
+    """
+    signatures = world['signatures']
+    despawned = []
+    for _, _, eid, cid, component in pop_due(world['timers'], dt):
+        if eid not in signatures:
+            continue
+        if cid is None:
+            despawned.append(eid)
+        else:
+            add_component(world, eid, cid, component)
+
+    if despawned:
+        remove_entities(world, despawned)
+
+def compact_world(world: WorldData) -> None:
+    """Releases slack memory of a world that is about to sit idle
+
+    Drops empty archetype tables, trims NumPy columns to their live rows,
+    shrinks dicts that lost entries, drops timers of removed entities,
+    and clears the sprite cache, events and interpolation state. Every
+    dict keeps its identity.
+    """
+    tables = world['tables']
+    for signature, table in list(tables.items()):
+        if not table['eids']:
+            del tables[signature]
+            continue
+
+        size = len(table['eids'])
+        for cid, column in table['columns'].items():
+            if not isinstance(column, list) and len(column) > size:
+                table['columns'][cid] = column[:size].copy()
+
+    for mapping in (
+        world['entities'],
+        *world['components'].values(),
+        world['signatures'],
+        world['locations'],
+        *world['views'].values(),
+        *world['tags'].values(),
+    ):
+        _shrink(mapping)
+
+    for channel in world['events'].values():
+        channel['previous'], channel['current'] = [], []
+    for previous in world['previous'].values():
+        previous.clear()
+    drop_timers(world['timers'], lambda timer: timer[2] not in world['signatures'])
+
+def _shrink(mapping: dict) -> None:
+    items = dict(mapping)
+    mapping.clear()
+    mapping.update(items)
@@ -0,0 +1,38 @@
+"""Typed event channels, double buffered across frames
+
+Events are stamped with the world tick they were emitted at. They stay
+readable for the frame they were emitted in and the next one, so a
+system reading everything after its last run sees each event once.
+"""
+
+from tp import *
+
+def add_channel(world: WorldData, name: str, kind: type = object) -> None:
+    """Creates the channel name, whose events must be instances of kind"""
+    if name not in world['events']:
+        world['events'][name] = {'kind': kind, 'previous': [], 'current': []}
+
+def emit(world: WorldData, name: str, event: object) -> None:
+    channel = world['events'][name]
+    if not isinstance(event, channel['kind']):
+        raise TypeError(
+            f"{name!r} takes {channel['kind'].__name__} events,"
+            f" not {type(event).__name__}"
+        )
+    channel['current'].append((world['tick'], event))
+
+def read_events(world: WorldData, name: str, since: int = 0) -> list[object]:
+    """Events on the channel emitted after the tick since, oldest first"""
+    channel = world['events'][name]
+    return [
+        event
+        for buffer in (channel['previous'], channel['current'])
+        for tick, event in buffer
+        if tick > since
+    ]
+
+def swap_events(world: WorldData) -> None:
+    """Drops the events of two frames ago, run at the start of a frame"""
+    for channel in world['events'].values():
+        channel['previous'] = channel['current']
+        channel['current'] = []
@@ -1,20 +1,79 @@
+import sys
+from tempfile import TemporaryDirectory
+from weakref import WeakKeyDictionary
+
 import pygame
 
-from ecs import add_components, quary_components, run_systems
+from ecs import (
+    add_channel,
+    add_components,
+    add_tags,
+    create_assets,
+    create_world,
+    declare_access,
+    dump_chrome_trace,
+    emit,
+    enable_fixed_step,
+    enable_profiling,
+    enable_spatial,
+    format_memory,
+    format_summary,
+    get_component,
+    has_components,
+    intern_asset,
+    last_run,
+    profile_span,
+    quary_rect,
+    quary_tuples,
+    read_events,
+    remove_tags,
+    run_fixed,
+    run_if,
+    spatial_system,
+    spawn_entity,
+    when_events,
+    world_memory,
+)
+from render import draw_sprites
+from manager import add_factory, create_manager, manager_memory, switch_world
+from snapshot import declare_codec
 from tp import *
 
 """Example of switching between levels with ecs"""
 
 DISPLAY_SIZE = (1920, 1080)
 FPS = 60
+# Simulation runs in fixed steps, at most MAX_STEPS per rendered frame
+STEP = 1 / 60
+MAX_STEPS = 5
+# Bytes of entities and components kept resident across levels
+LEVEL_BUDGET = 4 << 20
+QUERIES = (
+    ("speed", "velocity"),
+    ("position", "velocity"),
+    ("position", "size", "collider"),
+    ("position", "velocity", "collider"),
+)
+# System id -> (reads, writes); transition swaps the world, so it runs alone
+ACCESS = {
+    "velocity": (("speed",), ("velocity",)),
+    "movement": (("velocity",), ("position",)),
+    "spatial": (("position", "size"), ("spatial",)),
+    "collision": (
+        ("position", "size", "collider", "collidable", "spatial"),
+        ("triggered",),
+    ),
+    "trigger": (("triggered",), ("collider", "collidable")),
+}
+# Image -> key it was interned under, for as long as the image is alive,
+# so images the asset store evicted can still be saved
+IMAGE_KEYS: WeakKeyDictionary[pygame.Surface, tuple] = WeakKeyDictionary()
 
 
 def velocity_system(
     world:WorldData, events, game_state: dict, dt: float
 ):
-    for components in quary_components(world, ("speed", "velocity")).values():
-        speed, velocity = components.values()
-
+    for speed, velocity in quary_tuples(world, ("speed", "velocity"), False):
         for event in events:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_a:
@@ -31,267 +90,200 @@ def velocity_system(
 def movement_system(
     world:WorldData, events, game_state: dict, dt: float
 ):
-    for components in quary_components(world, ("position", "velocity")).values():
-        position, velocity = components.values()
-        position += velocity
+    for position, velocity in quary_tuples(world, ("position", "velocity"), False):
+        position += velocity * dt
 
 
 def collision_system(
     world:WorldData, events, game_state: dict, dt: float
 ):
-    """Triggers when collider is all inside collidable"""
-    emap, cmap = world.get('entities', {}), world.get('components', {})
-
-    for collider_components in quary_components(
-        world, ("position", "size", "collider")
-    ).values():
-        collider_position, collider_size, collider = collider_components.values()
-
-        if collider:
-            for collidable_id, collidable_components in quary_components(
-                world, ("position", "size", "trigger", "collidable")
-            ).items():
-                collidable_position, collidable_size, trigger, collidable = (
-                    collidable_components.values()
-                )
-                if (
-                    collidable
-                    and collider_position.x >= collidable_position.x
-                    and collider_position.y >= collidable_position.y
-                    and collider_position.x + collider_size.x
-                    <= collidable_position.x + collidable_size.x
-                    and collider_position.y + collider_size.y
-                    <= collidable_position.y + collidable_size.y
-                ):
-                    world['components']["trigger"][collidable_id] = True
-                    world['entities'][collidable_id]["trigger"] = True
+    """Emits a triggered event when collider is all inside collidable"""
+    for collider_position, collider_size in quary_tuples(
+        world, ("position", "size"), False, with_=("collider",)
+    ):
+        for collidable_id in quary_rect(
+            world, *collider_position, *collider_size, ("collidable",)
+        ):
+            collidable_position = get_component(world, collidable_id, "position")
+            collidable_size = get_component(world, collidable_id, "size")
+            if (
+                collider_position.x >= collidable_position.x
+                and collider_position.y >= collidable_position.y
+                and collider_position.x + collider_size.x
+                <= collidable_position.x + collidable_size.x
+                and collider_position.y + collider_size.y
+                <= collidable_position.y + collidable_size.y
+            ):
+                emit(world, "triggered", collidable_id)
 
 
 def trigger_system(
     world:WorldData, events, game_state: dict, dt: float
 ):
-    for entity_id, components in quary_components(
-        world, ("trigger", "collider", "collidable")
-    ).items():
-        trigger, collider, collidable = components.values()
-        if trigger:
-            world['entities'][entity_id]["collider"] = False
-            world['components']["collider"][entity_id] = False
-            world['entities'][entity_id]["collidable"] = False
-            world['components']["collidable"][entity_id] = False
+    for entity_id in read_events(world, "triggered", last_run(world, "trigger")):
+        if has_components(world, entity_id, ("collider", "collidable")):
+            remove_tags(world, entity_id, ("collider", "collidable"))
 
 
 def transition_system(
     world:WorldData, events, game_state: dict, dt: float
 ):
-    for entity_id, components in quary_components(
-        world, ("trigger", "transition", "position")
-    ).items():
-        trigger, transition, position = components.values()
-
-        if trigger:
-            game_state["world"] = transition
-            world['entities'][entity_id]["trigger"] = False
-            world['components']["trigger"][entity_id] = False
-
-            for entity_id, components in quary_components(
-                world, ("position", "velocity", "collider")
-            ).items():
-                pos, vel, _ = components.values()
+    for entity_id in read_events(world, "triggered", last_run(world, "transition")):
+        if has_components(world, entity_id, ("transition", "position")):
+            game_state["world"] = get_component(world, entity_id, "transition")
+
+            for pos, vel in quary_tuples(
+                world, ("position", "velocity"), False, with_=("collider",)
+            ):
                 pos.xy = (935, 1030)
                 vel.xy = (0, 0)
 
 
-def draw_entities(surface: pygame.Surface, world: WorldData) -> None:
-    for components in quary_components(world, ("image", "position")).values():
-        image, pos = components.values()
-        surface.blit(image, pos)
+def rect_image(
+    world: WorldData, size: pygame.Vector2, color: str
+) -> pygame.Surface:
+    key = ("rect", tuple(size), color)
 
+    def build() -> pygame.Surface:
+        image = pygame.Surface(size)
+        pygame.draw.rect(image, color, ((0, 0), size))
+        IMAGE_KEYS[image] = key
+        return image
 
-def main() -> None:
-    pygame.init()
+    return intern_asset(world, key, build)
 
-    screen = pygame.display.set_mode(DISPLAY_SIZE)
-    clock = pygame.time.Clock()
 
-    entity_id: EntityID = 0
-    worlds: dict[WorldID, WorldData] = {
-        "level_1": {
-            "entities": {},
-            "components": {},
-            "systems": {
-                "velocity": velocity_system,
-                "movement": movement_system,
-                "collision": collision_system,
-                "trigger": trigger_system,
-                "transition": transition_system,
-            },
-        },
-        "level_2": {
-            "entities": {},
-            "components": {},
-            "systems": {
-                "velocity": velocity_system,
-                "movement": movement_system,
-                "collision": collision_system,
-                "trigger": trigger_system,
-                "transition": transition_system,
-            },
-        },
-        "level_3": {
-            "entities": {},
-            "components": {},
-            "systems": {
-                "velocity": velocity_system,
-                "movement": movement_system,
-                "collision": collision_system,
-                "trigger": trigger_system,
-                "transition": transition_system,
-            },
-        },
-    }
-    game_state = {"world": "level_1"}
-
-    # LEVEL 1
-    entity_id += 1
-    player: EntityID = entity_id
+def add_player(world: WorldData) -> EntityID:
+    player = spawn_entity(world)
     player_size = pygame.Vector2((50, 50))
-    player_image = pygame.Surface(player_size)
-    pygame.draw.rect(player_image, "pink", ((0, 0), player_size))
     add_components(
-        worlds["level_1"],
+        world,
         player,
         (
             ("position", pygame.Vector2(935, 1030)),
             ("size", player_size),
-            ("speed", pygame.Vector2(10, 0)),
+            ("speed", pygame.Vector2(600, 0)),
             ("velocity", pygame.Vector2(0, 0)),
-            ("image", player_image),
-            ("collider", True),
+            ("image", rect_image(world, player_size, "pink")),
         ),
     )
+    add_tags(world, player, ("collider",))
 
-    entity_id += 1
-    red_teleporter: EntityID = entity_id
-    red_teleporter_position = pygame.Vector2(1570, 930)
-    red_teleporter_size = pygame.Vector2(150, 150)
-    red_teleporter_image = pygame.Surface(red_teleporter_size)
-    pygame.draw.rect(red_teleporter_image, "red", ((0, 0), red_teleporter_size))
-    add_components(
-        worlds["level_1"],
-        red_teleporter,
-        (
-            ("position", red_teleporter_position),
-            ("size", red_teleporter_size),
-            ("image", red_teleporter_image),
-            ("trigger", False),
-            ("transition", "level_2"),
-            ("collidable", True),
-        ),
-    )
+    return player
 
-    # LEVEL 2
-    entity_id += 1
-    player: EntityID = entity_id
-    player_size = pygame.Vector2((50, 50))
-    player_image = pygame.Surface(player_size)
-    pygame.draw.rect(player_image, "pink", ((0, 0), player_size))
-    add_components(
-        worlds["level_2"],
-        player,
-        (
-            ("position", pygame.Vector2(935, 1030)),
-            ("size", player_size),
-            ("speed", pygame.Vector2(10, 0)),
-            ("velocity", pygame.Vector2(0, 0)),
-            ("image", player_image),
-            ("collider", True),
-        ),
-    )
 
-    entity_id += 1
-    green_teleporter: EntityID = entity_id
-    green_teleporter_position = pygame.Vector2(1570, 930)
-    green_teleporter_size = pygame.Vector2(150, 150)
-    green_teleporter_image = pygame.Surface(green_teleporter_size)
-    pygame.draw.rect(green_teleporter_image, "green", ((0, 0), green_teleporter_size))
+def add_teleporter(
+    world: WorldData, position: tuple[int, int], color: str, transition: WorldID
+) -> EntityID:
+    teleporter = spawn_entity(world)
+    teleporter_size = pygame.Vector2(150, 150)
     add_components(
-        worlds["level_2"],
-        green_teleporter,
+        world,
+        teleporter,
         (
-            ("position", green_teleporter_position),
-            ("size", green_teleporter_size),
-            ("image", green_teleporter_image),
-            ("trigger", False),
-            ("transition", "level_3"),
-            ("collidable", True),
+            ("position", pygame.Vector2(position)),
+            ("size", teleporter_size),
+            ("image", rect_image(world, teleporter_size, color)),
+            ("transition", transition),
         ),
     )
+    add_tags(world, teleporter, ("collidable",))
 
-    entity_id += 1
-    purple_teleporter: EntityID = entity_id
-    purple_teleporter_position = pygame.Vector2(200, 930)
-    purple_teleporter_size = pygame.Vector2(150, 150)
-    purple_teleporter_image = pygame.Surface(purple_teleporter_size)
-    pygame.draw.rect(
-        purple_teleporter_image, "purple", ((0, 0), purple_teleporter_size)
-    )
-    add_components(
-        worlds["level_2"],
-        purple_teleporter,
-        (
-            ("position", purple_teleporter_position),
-            ("size", purple_teleporter_size),
-            ("image", purple_teleporter_image),
-            ("trigger", False),
-            ("transition", "level_1"),
-            ("collidable", True),
-        ),
-    )
+    return teleporter
 
-    # LEVEL 3
-    entity_id += 1
-    player: EntityID = entity_id
-    player_size = pygame.Vector2((50, 50))
-    player_image = pygame.Surface(player_size)
-    pygame.draw.rect(player_image, "pink", ((0, 0), player_size))
-    add_components(
-        worlds["level_3"],
-        player,
-        (
-            ("position", pygame.Vector2(935, 1030)),
-            ("size", player_size),
-            ("speed", pygame.Vector2(10, 0)),
-            ("velocity", pygame.Vector2(0, 0)),
-            ("image", player_image),
-            ("collider", True),
-        ),
-    )
 
-    entity_id += 1
-    orange_teleporter: EntityID = entity_id
-    orange_teleporter_position = pygame.Vector2(200, 930)
-    orange_teleporter_size = pygame.Vector2(150, 150)
-    orange_teleporter_image = pygame.Surface(orange_teleporter_size)
-    pygame.draw.rect(
-        orange_teleporter_image, "orange", ((0, 0), orange_teleporter_size)
-    )
-    add_components(
-        worlds["level_3"],
-        orange_teleporter,
-        (
-            ("position", orange_teleporter_position),
-            ("size", orange_teleporter_size),
-            ("image", orange_teleporter_image),
-            ("trigger", False),
-            ("transition", "level_2"),
-            ("collidable", True),
-        ),
+def build_level_1(world: WorldData) -> None:
+    add_player(world)
+    add_teleporter(world, (1570, 930), "red", "level_2")
+
+
+def build_level_2(world: WorldData) -> None:
+    add_player(world)
+    add_teleporter(world, (1570, 930), "green", "level_3")
+    add_teleporter(world, (200, 930), "purple", "level_1")
+
+
+def build_level_3(world: WorldData) -> None:
+    add_player(world)
+    add_teleporter(world, (200, 930), "orange", "level_2")
+
+
+LEVELS = {
+    "level_1": build_level_1,
+    "level_2": build_level_2,
+    "level_3": build_level_3,
+}
+
+
+def create_level(systems: SystemMap, assets: AssetStore) -> WorldData:
+    world = create_world(systems, QUERIES, assets=assets)
+    enable_spatial(world)
+    enable_fixed_step(world, STEP, MAX_STEPS, ("position",))
+    add_channel(world, "triggered", int)
+    for sid, (reads, writes) in ACCESS.items():
+        declare_access(world, sid, reads, writes)
+    # Both only react to teleporters firing
+    run_if(world, "trigger", when_events("triggered"))
+    run_if(world, "transition", when_events("triggered"))
+    if "--profile" in sys.argv:
+        enable_profiling(world)
+
+    # Images are saved as the keys they were interned under
+    def encode(images: list[pygame.Surface]) -> list[tuple]:
+        return [IMAGE_KEYS[image] for image in images]
+
+    def decode(keys: list[tuple]) -> list[pygame.Surface]:
+        return [
+            rect_image(world, pygame.Vector2(size), color) for _, size, color in keys
+        ]
+
+    declare_codec(world, "image", encode, decode)
+
+    return world
+
+
+def report_level(level_id: WorldID, world: WorldData) -> None:
+    if world['profiler'] is not None and world['profiler']['frames']:
+        print(f"== {level_id}")
+        print(format_summary(world['profiler']))
+        print(format_memory(world_memory(world)))
+        dump_chrome_trace(world['profiler'], f"{level_id}.trace.json")
+
+
+def main() -> None:
+    pygame.init()
+
+    screen = pygame.display.set_mode(DISPLAY_SIZE)
+    clock = pygame.time.Clock()
+
+    systems: SystemMap = {
+        "velocity": velocity_system,
+        "movement": movement_system,
+        "spatial": spatial_system,
+        "collision": collision_system,
+        "trigger": trigger_system,
+        "transition": transition_system,
+    }
+    assets = create_assets()
+    # Levels are built on first visit and streamed back in from snapshots
+    # once they were evicted
+    levels = TemporaryDirectory(prefix="levels-")
+    manager = create_manager(
+        lambda: create_level(systems, assets),
+        levels.name,
+        LEVEL_BUDGET,
+        report_level,
     )
+    for level_id, build in LEVELS.items():
+        add_factory(manager, level_id, build)
+
+    game_state = {"world": "level_1"}
+    level_id = game_state["world"]
+    world = switch_world(manager, level_id)
 
     running = True
     while running:
-        dt = clock.tick(FPS) / 1000
+        frame_time = clock.tick(FPS) / 1000
 
         # Events
         events = pygame.event.get()
@@ -303,18 +295,25 @@ def main() -> None:
                 if event.key == pygame.K_ESCAPE:
                     running = False
 
-        run_systems(
-            worlds[game_state["world"]],
-            events,
-            game_state,
-            dt,
-        )
+        run_fixed(world, events, game_state, frame_time)
+
+        if game_state["world"] != level_id:
+            level_id = game_state["world"]
+            world = switch_world(manager, level_id)
 
         # Render
         screen.fill("gray")
-        draw_entities(screen, worlds[game_state["world"]])
+        with profile_span(world, "draw"):
+            draw_sprites(screen, world)
         pygame.display.flip()
 
+    for level_id, world in manager['resident'].items():
+        report_level(level_id, world)
+    if "--profile" in sys.argv:
+        for level_id, usage in manager_memory(manager).items():
+            print(level_id, usage)
+    levels.cleanup()
+
 
 if __name__ == "__main__":
     main()
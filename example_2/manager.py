@@ -0,0 +1,109 @@
+"""Builds worlds on demand and keeps the resident ones under a budget
+
+Switching away from a world compacts it. When the resident worlds use
+more than the memory budget, the least recently used ones are saved to
+snapshots and dropped, to be loaded back when they're switched to.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Callable
+from tp import *
+from ecs import compact_world, world_memory
+from snapshot import load_snapshot, save_snapshot
+
+def create_manager(
+    create: Callable[[], WorldData],
+    directory: str,
+    budget: int = 64 << 20,
+    on_evict: Callable[[WorldID, WorldData], None] | None = None,
+) -> WorldManager:
+    """create returns an empty, set up world; snapshots go in directory
+
+    budget is in bytes as measured by world_memory. on_evict is called
+    with a world right before it's dropped.
+    """
+    return {
+        'create': create,
+        'factories': {},
+        'directory': directory,
+        'budget': budget,
+        'resident': OrderedDict(),
+        'evicted': {},
+        'active': None,
+        'on_evict': on_evict,
+        'sizes': {},
+    }
+
+def add_factory(
+    manager: WorldManager, world_id: WorldID, build: Callable[[WorldData], None]
+) -> None:
+    """build fills an empty world the first time world_id is needed"""
+    manager['factories'][world_id] = build
+
+def get_world(manager: WorldManager, world_id: WorldID) -> WorldData:
+    """The world, made resident by loading or building it if needed"""
+    resident = manager['resident']
+    if world_id in resident:
+        resident.move_to_end(world_id)
+        return resident[world_id]
+
+    world = manager['create']()
+    if world_id in manager['evicted']:
+        load_snapshot(world, manager['evicted'].pop(world_id))
+    else:
+        manager['factories'][world_id](world)
+    resident[world_id] = world
+
+    return world
+
+def switch_world(manager: WorldManager, world_id: WorldID) -> WorldData:
+    """Makes world_id the active world, suspending the previous one"""
+    previous = manager['active']
+    if previous is not None and previous != world_id:
+        suspended = manager['resident'][previous]
+        compact_world(suspended)
+        manager['sizes'][previous] = world_memory(suspended)['total']
+
+    world = get_world(manager, world_id)
+    manager['active'] = world_id
+    manager['sizes'][world_id] = world_memory(world)['total']
+    _enforce_budget(manager)
+
+    return world
+
+def evict_world(manager: WorldManager, world_id: WorldID) -> None:
+    world = manager['resident'].pop(world_id)
+    manager['sizes'].pop(world_id, None)
+    if manager['on_evict'] is not None:
+        manager['on_evict'](world_id, world)
+
+    path = os.path.join(manager['directory'], f"{world_id}.snapshot")
+    save_snapshot(world, path)
+    manager['evicted'][world_id] = path
+
+def _enforce_budget(manager: WorldManager) -> None:
+    """Evicts least recently used worlds, sized when they were suspended"""
+    sizes = manager['sizes']
+    for world_id, world in manager['resident'].items():
+        if world_id not in sizes:
+            sizes[world_id] = world_memory(world)['total']
+
+    total = sum(sizes.values())
+    for world_id in list(manager['resident']):
+        if total <= manager['budget']:
+            break
+        if world_id != manager['active']:
+            total -= sizes[world_id]
+            evict_world(manager, world_id)
+
+def manager_memory(manager: WorldManager) -> dict[WorldID, dict[str, int]]:
+    """Entities and bytes of resident worlds, snapshot bytes of evicted ones"""
+    report = {}
+    for world_id, world in manager['resident'].items():
+        memory = world_memory(world)
+        report[world_id] = {'entities': memory['entities'], 'bytes': memory['total']}
+    for world_id, path in manager['evicted'].items():
+        report[world_id] = {'disk': os.path.getsize(path)}
+
+    return report
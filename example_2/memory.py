@@ -0,0 +1,82 @@
+"""Approximate memory use of a world's entities and components
+
+Sizes are shallow sys.getsizeof sizes, or nbytes for NumPy columns, and
+every object is counted once. Interned assets are shared between worlds
+and left out. Components declared with a schema also count their field
+values, and are reported with the size they would take packed.
+"""
+
+import sys
+from typing import Iterable
+from tp import *
+from schema import packed_size
+
+def _unique_size(objects: Iterable[object], seen: set[int]) -> int:
+    """Total size of the objects not seen yet, which become seen"""
+    fresh = {id(obj): obj for obj in objects}
+    for key in fresh.keys() & seen:
+        del fresh[key]
+    seen.update(fresh)
+
+    return sum(map(sys.getsizeof, fresh.values()))
+
+def world_memory(world: WorldData) -> MemoryReport:
+    seen = {id(asset) for asset in world['assets']['items'].values()}
+    schemas = world['schemas']
+    components: dict[ComponentID, int] = {}
+    counts: dict[ComponentID, int] = {}
+
+    def add(cid: ComponentID, values: Iterable[Component], used: int) -> None:
+        if cid in schemas:
+            # Slotted objects point at their field values, count those too
+            values = list(values)
+            fields = schemas[cid].__slots__
+            used += _unique_size(
+                (getattr(value, field) for value in values for field in fields), seen
+            )
+            counts[cid] = counts.get(cid, 0) + len(values)
+        components[cid] = components.get(cid, 0) + used
+
+    if world['storage'] == 'archetype':
+        index = _unique_size((world['tables'], world['locations']), seen)
+        for table in world['tables'].values():
+            index += sys.getsizeof(table['eids'])
+            for cid, column in table['columns'].items():
+                if isinstance(column, list):
+                    add(cid, column, sys.getsizeof(column) + _unique_size(column, seen))
+                else:
+                    add(cid, (), column.nbytes)
+    else:
+        emap = world['entities']
+        index = sys.getsizeof(emap) + sum(map(sys.getsizeof, emap.values()))
+        for cid, store in world['components'].items():
+            used = sys.getsizeof(store) + _unique_size(store.values(), seen)
+            add(cid, store.values(), used)
+
+    for tag, members in world['tags'].items():
+        components[tag] = sys.getsizeof(members)
+
+    index += sys.getsizeof(world['signatures']) + sum(
+        map(sys.getsizeof, world['views'].values())
+    )
+    return {
+        'entities': len(world['signatures']),
+        'components': components,
+        'packed': {
+            cid: packed_size(schemas[cid], count) for cid, count in counts.items()
+        },
+        'index': index,
+        'total': index + sum(components.values()),
+    }
+
+def format_memory(report: MemoryReport) -> str:
+    lines = [f"{report['entities']} entities, {report['total'] / 1024:.1f} KiB"]
+    lines.append(f"  {'index':<16} {report['index'] / 1024:>10.1f} KiB")
+    packed = report['packed']
+    for cid, used in sorted(report['components'].items(), key=lambda item: -item[1]):
+        line = f"  {cid:<16} {used / 1024:>10.1f} KiB"
+        if cid in packed:
+            line += f" {packed[cid] / 1024:>10.1f} KiB packed"
+        lines.append(line)
+
+    return "\n".join(lines)
@@ -0,0 +1,150 @@
+"""Per-system frame timings kept in a ring buffer
+
+A frame starts when run_systems or run_fixed is called and ends when
+either is called again, so spans recorded in between, like rendering,
+count towards it. run_fixed is one frame however many steps it runs.
+"""
+
+import json
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+from tp import *
+
+def create_profiler(capacity: int = 600) -> Profiler:
+    return {
+        'frames': deque(maxlen=capacity),
+        'current': None,
+        'origin': perf_counter(),
+        'count': 0,
+    }
+
+def begin_frame(profiler: Profiler) -> None:
+    end_frame(profiler)
+    profiler['current'] = {
+        'frame': profiler['count'],
+        'start': perf_counter(),
+        'duration': 0.0,
+        'spans': [],
+    }
+    profiler['count'] += 1
+
+def end_frame(profiler: Profiler) -> None:
+    frame = profiler['current']
+    if frame is not None:
+        frame['duration'] = perf_counter() - frame['start']
+        profiler['frames'].append(frame)
+        profiler['current'] = None
+
+def _counters(world: WorldData) -> tuple[int, int, int]:
+    stats = world['query_stats']
+    return stats['hits'] + stats['misses'], stats['matched'], world['changes']
+
+@contextmanager
+def profile_span(world: WorldData, name: str) -> Iterator[None]:
+    """Records the time, queries, matches and structural changes of the
+    block; counters are shared, so spans overlapping in threads blur"""
+    profiler = world['profiler']
+    if profiler is None or profiler['current'] is None:
+        yield
+        return
+
+    queries, matched, changes = _counters(world)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        end = perf_counter()
+        after = _counters(world)
+        profiler['current']['spans'].append({
+            'name': name,
+            'start': start,
+            'duration': end - start,
+            'queries': after[0] - queries,
+            'matched': after[1] - matched,
+            'changes': after[2] - changes,
+        })
+
+def profile_summary(profiler: Profiler) -> dict[str, dict[str, float]]:
+    """Rolling per-span averages and maxima over the buffered frames"""
+    frames = list(profiler['frames'])
+    if not frames:
+        return {}
+
+    durations = sorted(frame['duration'] for frame in frames)
+    summary = {
+        'frame': {
+            'calls': len(frames),
+            'mean_ms': sum(durations) / len(durations) * 1000,
+            'p95_ms': durations[int(len(durations) * 0.95)] * 1000,
+            'max_ms': durations[-1] * 1000,
+        }
+    }
+
+    spans: dict[str, list[Span]] = {}
+    for frame in frames:
+        for span in frame['spans']:
+            spans.setdefault(span['name'], []).append(span)
+
+    for name, records in spans.items():
+        calls = len(records)
+        summary[name] = {
+            'calls': calls,
+            'mean_ms': sum(r['duration'] for r in records) / calls * 1000,
+            'max_ms': max(r['duration'] for r in records) * 1000,
+            'queries': sum(r['queries'] for r in records) / calls,
+            'matched': sum(r['matched'] for r in records) / calls,
+            'changes': sum(r['changes'] for r in records) / calls,
+        }
+
+    return summary
+
+def format_summary(profiler: Profiler) -> str:
+    lines = [
+        f"{'span':<16} {'calls':>6} {'mean ms':>8} {'max ms':>8}"
+        f" {'queries':>8} {'matched':>9} {'changes':>8}"
+    ]
+    for name, row in profile_summary(profiler).items():
+        lines.append(
+            f"{name:<16} {row['calls']:>6} {row['mean_ms']:>8.3f}"
+            f" {row['max_ms']:>8.3f} {row.get('queries', 0):>8.1f}"
+            f" {row.get('matched', 0):>9.1f} {row.get('changes', 0):>8.1f}"
+        )
+
+    return "\n".join(lines)
+
+def dump_json(profiler: Profiler, path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(list(profiler['frames']), file)
+
+def dump_chrome_trace(profiler: Profiler, path: str) -> None:
+    """Writes the buffered frames for chrome://tracing or Perfetto"""
+    origin = profiler['origin']
+    events = []
+    for frame in profiler['frames']:
+        events.append({
+            'name': f"frame {frame['frame']}",
+            'ph': 'X',
+            'ts': (frame['start'] - origin) * 1e6,
+            'dur': frame['duration'] * 1e6,
+            'pid': 0,
+            'tid': 0,
+        })
+        for span in frame['spans']:
+            events.append({
+                'name': span['name'],
+                'ph': 'X',
+                'ts': (span['start'] - origin) * 1e6,
+                'dur': span['duration'] * 1e6,
+                'pid': 0,
+                'tid': 1,
+                'args': {
+                    'queries': span['queries'],
+                    'matched': span['matched'],
+                    'changes': span['changes'],
+                },
+            })
+
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events}, file)
@@ -0,0 +1,37 @@
+"""Interns component ids to small integers for bitmask signatures"""
+
+from threading import Lock
+from typing import Iterable
+from tp import *
+
+# Systems of a parallel stage may intern new cids at the same time
+_INTERNING = Lock()
+
+def component_index(world: WorldData, cid: ComponentID) -> int:
+    registry = world['registry']
+    index = registry.get(cid)
+    if index is None:
+        with _INTERNING:
+            index = registry.get(cid)
+            if index is None:
+                index = registry[cid] = len(registry)
+
+    return index
+
+def cids_mask(world: WorldData, cids: Iterable[ComponentID]) -> int:
+    mask = 0
+    for cid in cids:
+        mask |= 1 << component_index(world, cid)
+
+    return mask
+
+def query_mask(world: WorldData, cids: Query) -> int:
+    """The signature bits an entity needs to match cids, cached per query"""
+    masks = world['query_masks']
+    if cids not in masks:
+        masks[cids] = cids_mask(world, cids)
+
+    return masks[cids]
+
+def signature_cids(world: WorldData, signature: int) -> list[ComponentID]:
+    return [cid for cid, index in world['registry'].items() if signature >> index & 1]
@@ -0,0 +1,38 @@
+"""Batched sprite drawing straight from the image and position components"""
+
+from ecs import lerp, quary_tuples
+from tp import *
+
+SPRITES: Query = ("image", "position")
+
+def draw_sprites(surface, world: WorldData, viewport=None) -> None:
+    """Blits every sprite in one call, skipping those outside viewport
+
+    Images and positions are read when drawing, so moved rows, grown
+    columns and replaced components are always drawn as they are now.
+    Positions are interpolated between the last two fixed steps when the
+    world keeps their previous values, see enable_fixed_step.
+    """
+    previous = world['previous'].get("position")
+    if previous:
+        alpha = world['timestep']['alpha']
+        sprites = [
+            (image, lerp(previous[eid], position, alpha))
+            if eid in previous
+            else (image, position)
+            for eid, image, position in quary_tuples(world, SPRITES)
+        ]
+    else:
+        sprites = quary_tuples(world, SPRITES, False)
+    if viewport is not None:
+        sprites = [
+            (image, position)
+            for image, position in sprites
+            if viewport.colliderect((position, image.get_size()))
+        ]
+
+    fblits = getattr(surface, 'fblits', None)
+    if fblits is not None:
+        fblits(iter(sprites))
+    else:
+        surface.blits(iter(sprites), doreturn=False)
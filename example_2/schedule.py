@@ -0,0 +1,41 @@
+"""Groups systems into stages from their declared component access"""
+
+from tp import *
+
+def conflicts(a: Access, b: Access) -> bool:
+    return bool(
+        a['writes'] & (b['reads'] | b['writes']) or b['writes'] & a['reads']
+    )
+
+def build_stages(
+    systems: SystemMap, access: dict[SystemID, Access]
+) -> list[list[SystemID]]:
+    """Places each system in the first stage after every earlier system
+    it conflicts with, so stages keep the declaration order's effects
+
+    Systems without a declared access run alone in their own stage.
+    """
+    stages: list[list[SystemID]] = []
+    earliest = 0
+    for sid in systems:
+        if sid not in access:
+            stages.append([sid])
+            earliest = len(stages)
+            continue
+
+        stage = earliest
+        for index in range(len(stages) - 1, earliest - 1, -1):
+            if any(conflicts(access[sid], access[other]) for other in stages[index]):
+                stage = index + 1
+                break
+
+        if stage == len(stages):
+            stages.append([])
+        stages[stage].append(sid)
+
+    return stages
+
+def format_stages(stages: list[list[SystemID]]) -> str:
+    return "\n".join(
+        f"stage {index}: {', '.join(stage)}" for index, stage in enumerate(stages)
+    )
@@ -0,0 +1,80 @@
+"""Component types generated from declared fields
+
+A schema maps field names to float, int or bool. component_type turns
+it into a class with __slots__, so instances carry no __dict__, and
+pack lays a list of instances out as one array per field, for bulk
+copies and snapshots.
+"""
+
+import keyword
+from array import array
+from operator import attrgetter
+from typing import Iterable
+from tp import *
+
+TYPECODES = {float: 'd', int: 'q', bool: 'b'}
+# Taken by the generated __init__ and class attributes
+RESERVED = frozenset({'self', 'copy', 'schema'})
+
+def component_type(name: str, schema: Schema) -> type:
+    for field, kind in schema.items():
+        if not field.isidentifier() or keyword.iskeyword(field):
+            raise ValueError(f"{name}.{field!r} is not a valid field name")
+        if field in RESERVED or field.startswith('__'):
+            raise ValueError(f"{name}.{field!r} is reserved, pick another field name")
+        if kind not in TYPECODES:
+            raise TypeError(
+                f"{name}.{field} is {kind.__name__}, schemas take float, int or bool"
+            )
+
+    fields = tuple(schema)
+    # Generated like a dataclass __init__, keyword defaults are zeros
+    arguments = ", ".join(f"{field}={schema[field]()!r}" for field in fields)
+    body = "".join(f"\n    self.{field} = {field}" for field in fields)
+    namespace: dict = {}
+    exec(f"def __init__(self, {arguments}):{body or ' pass'}", {}, namespace)
+
+    if len(fields) > 1:
+        values = attrgetter(*fields)
+    else:
+        values = lambda self: tuple(getattr(self, field) for field in fields)
+
+    def __repr__(self) -> str:
+        pairs = zip(fields, values(self))
+        return f"{name}({', '.join(f'{field}={value!r}' for field, value in pairs)})"
+
+    def __eq__(self, other: object) -> bool:
+        return type(other) is type(self) and values(other) == values(self)
+
+    def copy(self):
+        return cls(*values(self))
+
+    cls = type(
+        name,
+        (),
+        {
+            '__slots__': fields,
+            '__init__': namespace['__init__'],
+            '__repr__': __repr__,
+            '__eq__': __eq__,
+            '__hash__': None,
+            'copy': copy,
+            'schema': dict(schema),
+        },
+    )
+    return cls
+
+def pack(cls: type, components: Iterable[Component]) -> dict[str, array]:
+    """One array per field of cls, holding that field of every component"""
+    components = list(components)
+    return {
+        field: array(TYPECODES[kind], map(attrgetter(field), components))
+        for field, kind in cls.schema.items()
+    }
+
+def unpack(cls: type, packed: dict[str, array]) -> list[Component]:
+    return list(map(cls, *(packed[field] for field in cls.schema)))
+
+def packed_size(cls: type, count: int) -> int:
+    """Bytes count components of cls take packed"""
+    return count * sum(array(TYPECODES[kind]).itemsize for kind in cls.schema.values())
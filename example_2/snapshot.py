@@ -0,0 +1,167 @@
+"""Binary world snapshots
+
+A snapshot is a small JSON header followed by one block per column, 64
+byte aligned. Entities are grouped by component set, like archetype
+tables, and every column of a group is encoded in one go: NumPy columns
+are written raw and can be memory-mapped back, anything else is pickled
+as one list, after the component's codec if it has one.
+
+Pickled blocks run code when loaded, so only load snapshots you wrote.
+"""
+
+import json
+import mmap
+import pickle
+import struct
+from typing import Callable, Sequence
+from tp import *
+from ecs import add_entities, add_tags
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"ECSSNAP4"
+ALIGN = 64
+_HEADER = struct.Struct("<8sQ")
+
+def declare_codec(
+    world: WorldData,
+    cid: ComponentID,
+    encode: Callable[[list[Component]], object],
+    decode: Callable[[object], Sequence[Component]],
+) -> None:
+    """Converts cid's column before saving and after loading
+
+    encode takes the list of values and returns a NumPy array or anything
+    that pickles; decode gets that back and returns the values.
+    """
+    world['codecs'][cid] = {'encode': encode, 'decode': decode}
+
+def _groups(world: WorldData) -> list[tuple[list[EntityID], dict[ComponentID, Column]]]:
+    """Entities sharing a component set, with their columns"""
+    if world['storage'] == 'archetype':
+        groups = []
+        for table in world['tables'].values():
+            size = len(table['eids'])
+            if size:
+                columns = {
+                    cid: column if isinstance(column, list) else column[:size]
+                    for cid, column in table['columns'].items()
+                }
+                groups.append((table['eids'], columns))
+        return groups
+
+    by_signature: dict[int, list[EntityID]] = {}
+    signatures = world['signatures']
+    for eid in world['entities']:
+        by_signature.setdefault(signatures[eid], []).append(eid)
+
+    emap, cmap = world['entities'], world['components']
+    return [
+        (eids, {cid: [cmap[cid][eid] for eid in eids] for cid in emap[eids[0]]})
+        for eids in by_signature.values()
+    ]
+
+def _block(value: object, blocks: list, offset: int) -> tuple[dict, int]:
+    if np is not None and isinstance(value, np.ndarray):
+        data = memoryview(np.ascontiguousarray(value)).cast('B')
+        ref = {'kind': 'array', 'dtype': value.dtype.str, 'shape': value.shape}
+    else:
+        data = pickle.dumps(value, protocol=5)
+        ref = {'kind': 'pickle'}
+
+    ref['offset'], ref['nbytes'] = offset, len(data)
+    blocks.append(data)
+    return ref, offset + -(-len(data) // ALIGN) * ALIGN
+
+def save_snapshot(world: WorldData, path: str) -> None:
+    """Writes the world's entities, components, tags, id allocator and timers"""
+    codecs = world['codecs']
+    blocks: list = []
+    offset = 0
+    allocator, offset = _block(world['allocator'], blocks, offset)
+    timers, offset = _block(world['timers'], blocks, offset)
+    tags = {tag: list(members) for tag, members in world['tags'].items() if members}
+    tags, offset = _block(tags, blocks, offset)
+    groups = []
+    for eids, columns in _groups(world):
+        ids = np.array(eids, np.int64) if np is not None else list(eids)
+        eids_ref, offset = _block(ids, blocks, offset)
+        refs = {}
+        for cid, values in columns.items():
+            if cid in codecs:
+                values = codecs[cid]['encode'](list(values))
+            refs[cid], offset = _block(values, blocks, offset)
+            refs[cid]['codec'] = cid in codecs
+        groups.append({'count': len(eids), 'eids': eids_ref, 'columns': refs})
+
+    header = json.dumps(
+        {'allocator': allocator, 'timers': timers, 'tags': tags, 'groups': groups}
+    ).encode()
+    start = -(-(_HEADER.size + len(header)) // ALIGN) * ALIGN
+    with open(path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, len(header)))
+        file.write(header)
+        file.write(bytes(start - _HEADER.size - len(header)))
+        for data in blocks:
+            file.write(data)
+            file.write(bytes(-len(data) % ALIGN))
+
+def _read_block(buffer, start: int, ref: dict) -> object:
+    offset = start + ref['offset']
+    if ref['kind'] == 'pickle':
+        return pickle.loads(buffer[offset:offset + ref['nbytes']])
+    if np is None:
+        raise ImportError("snapshots with array columns need numpy")
+
+    dtype = np.dtype(ref['dtype'])
+    count = ref['nbytes'] // dtype.itemsize
+    array = np.frombuffer(buffer, dtype, count, offset)
+    return array.reshape(ref['shape'])
+
+def load_snapshot(world: WorldData, path: str, memory_map: bool = True) -> None:
+    """Adds the entities saved at path to an empty world
+
+    Systems, views, declared columns and codecs come from the world, so
+    set them up first. With memory_map, array columns are copy-on-write
+    views of the file, read in as they are touched.
+    """
+    if world['signatures'] or world['allocator']['generations']:
+        raise ValueError("snapshots load into an empty world")
+
+    with open(path, 'rb') as file:
+        if memory_map:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            buffer = bytearray(file.read())
+
+    magic, length = _HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a world snapshot")
+    header = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + length]))
+    start = -(-(_HEADER.size + length) // ALIGN) * ALIGN
+
+    world['allocator'] = _read_block(buffer, start, header['allocator'])
+    world['timers'] = _read_block(buffer, start, header['timers'])
+    codecs = world['codecs']
+    for group in header['groups']:
+        eids = _read_block(buffer, start, group['eids'])
+        columns = {}
+        for cid, ref in group['columns'].items():
+            values = _read_block(buffer, start, ref)
+            if ref['codec'] and cid not in codecs:
+                raise ValueError(f"{cid!r} was saved encoded, declare its codec first")
+            if cid in codecs:
+                values = codecs[cid]['decode'](values)
+            elif cid not in world['columns'] and not isinstance(values, list):
+                values = list(values)
+            columns[cid] = values
+        if not isinstance(eids, list):
+            eids = eids.tolist()
+        add_entities(world, eids, columns)
+
+    for tag, eids in _read_block(buffer, start, header['tags']).items():
+        for eid in eids:
+            add_tags(world, eid, (tag,))
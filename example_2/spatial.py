@@ -0,0 +1,61 @@
+"""Uniform grid broad phase over entity bounding boxes"""
+
+from tp import *
+
+def create_grid(cell_size: float) -> SpatialGrid:
+    return {'cell_size': cell_size, 'cells': {}, 'spans': {}}
+
+def grid_span(
+    grid: SpatialGrid, x: float, y: float, w: float, h: float
+) -> tuple[int, int, int, int]:
+    """First and last cell column and row covered by the rectangle"""
+    size = grid['cell_size']
+    return (int(x // size), int(y // size), int((x + w) // size), int((y + h) // size))
+
+def _cells(span: tuple[int, int, int, int]):
+    x0, y0, x1, y1 = span
+    for cx in range(x0, x1 + 1):
+        for cy in range(y0, y1 + 1):
+            yield cx, cy
+
+def grid_insert(
+    grid: SpatialGrid, eid: EntityID, span: tuple[int, int, int, int]
+) -> None:
+    cells = grid['cells']
+    for cell in _cells(span):
+        if cell not in cells:
+            cells[cell] = set()
+        cells[cell].add(eid)
+    grid['spans'][eid] = span
+
+def grid_remove(grid: SpatialGrid, eid: EntityID) -> None:
+    span = grid['spans'].pop(eid, None)
+    if span is None:
+        return
+
+    cells = grid['cells']
+    for cell in _cells(span):
+        bucket = cells[cell]
+        bucket.discard(eid)
+        if not bucket:
+            del cells[cell]
+
+def grid_move(
+    grid: SpatialGrid, eid: EntityID, span: tuple[int, int, int, int]
+) -> None:
+    """Re-bins eid only when the cells it covers changed"""
+    if grid['spans'].get(eid) != span:
+        grid_remove(grid, eid)
+        grid_insert(grid, eid, span)
+
+def grid_quary(
+    grid: SpatialGrid, span: tuple[int, int, int, int]
+) -> set[EntityID]:
+    """Entities binned in any cell of span, a superset of the overlaps"""
+    cells = grid['cells']
+    found = set()
+    for cell in _cells(span):
+        if cell in cells:
+            found |= cells[cell]
+
+    return found
@@ -0,0 +1,32 @@
+"""Per-component added, changed and removed ticks
+
+Every record map is kept in tick order, so the entities stamped after a
+tick are read from its end without walking the rest.
+"""
+
+from tp import *
+
+def create_ticks() -> ChangeTicks:
+    return {'added': {}, 'changed': {}, 'removed': {}}
+
+def stamp(records: dict[EntityID, int], eid: EntityID, tick: int) -> None:
+    records.pop(eid, None)
+    records[eid] = tick
+
+def stamped_since(records: dict[EntityID, int], tick: int) -> list[EntityID]:
+    """Entities stamped after tick, newest first"""
+    found = []
+    for eid, stamped in reversed(records.items()):
+        if stamped <= tick:
+            break
+        found.append(eid)
+
+    return found
+
+def prune(records: dict[EntityID, int], tick: int) -> None:
+    """Drops the records stamped at or before tick"""
+    while records:
+        eid, stamped = next(iter(records.items()))
+        if stamped > tick:
+            break
+        del records[eid]
@@ -0,0 +1,61 @@
+"""Deadlines on simulation time, kept in a heap
+
+Popping the due timers costs O(log n) each, so a frame only pays for
+the timers that actually expire. Cancelled timers stay in the heap
+until they come due and are skipped then; pending tells cancel which
+ids are still in the heap without searching it.
+"""
+
+import heapq
+from typing import Callable
+from tp import *
+
+def create_timers() -> Timers:
+    return {'time': 0.0, 'heap': [], 'next': 0, 'pending': set(), 'cancelled': set()}
+
+def push_timer(
+    timers: Timers,
+    delay: float,
+    eid: EntityID,
+    cid: ComponentID | None,
+    component: Component,
+) -> TimerID:
+    timer = timers['next']
+    timers['next'] += 1
+    timers['pending'].add(timer)
+    heapq.heappush(
+        timers['heap'], (timers['time'] + delay, timer, eid, cid, component)
+    )
+    return timer
+
+def cancel(timers: Timers, timer: TimerID) -> None:
+    """Skips timer when it comes due, timers that already fired are ignored"""
+    if timer in timers['pending']:
+        timers['cancelled'].add(timer)
+
+def pop_due(timers: Timers, dt: float) -> list[Timer]:
+    """Advances time by dt and pops the timers due by then, earliest first"""
+    timers['time'] += dt
+    heap, pending, cancelled = timers['heap'], timers['pending'], timers['cancelled']
+    due = []
+    while heap and heap[0][0] <= timers['time']:
+        timer = heapq.heappop(heap)
+        pending.discard(timer[1])
+        if timer[1] in cancelled:
+            cancelled.discard(timer[1])
+        else:
+            due.append(timer)
+
+    return due
+
+def drop_timers(timers: Timers, dead: Callable[[Timer], bool]) -> None:
+    """Removes cancelled timers and those dead returns True for"""
+    cancelled = timers['cancelled']
+    timers['heap'] = [
+        timer
+        for timer in timers['heap']
+        if timer[1] not in cancelled and not dead(timer)
+    ]
+    heapq.heapify(timers['heap'])
+    timers['pending'] = {timer[1] for timer in timers['heap']}
+    cancelled.clear()
@@ -0,0 +1,42 @@
+"""Fixed simulation steps out of variable frame times
+
+Frame time accumulates and is spent in whole steps. At most max_steps
+run per frame; time beyond that is dropped, so a slow frame slows the
+game down for a moment instead of making the next frames slower still.
+"""
+
+from tp import *
+
+def create_timestep(step: float = 1 / 60, max_steps: int = 5) -> Timestep:
+    return {
+        'step': step,
+        'max_steps': max_steps,
+        'accumulator': 0.0,
+        'alpha': 0.0,
+        'steps': 0,
+        'dropped': 0.0,
+    }
+
+def advance(timestep: Timestep, frame_time: float) -> int:
+    """Adds frame_time and returns how many steps to run for it
+
+    alpha is then the fraction of a step left over, for interpolating
+    between the last two simulated states.
+    """
+    step = timestep['step']
+    timestep['accumulator'] += frame_time
+    steps = int(timestep['accumulator'] // step)
+    if steps > timestep['max_steps']:
+        dropped = (steps - timestep['max_steps']) * step
+        timestep['accumulator'] -= dropped
+        timestep['dropped'] += dropped
+        steps = timestep['max_steps']
+
+    timestep['accumulator'] -= steps * step
+    timestep['alpha'] = timestep['accumulator'] / step
+    timestep['steps'] += steps
+
+    return steps
+
+def lerp(previous: object, current: object, alpha: float) -> object:
+    return previous + (current - previous) * alpha
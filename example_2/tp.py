@@ -1,4 +1,6 @@
-from typing import TypedDict
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+from typing import Literal, TypedDict
 
 type EntityID = int
 type ComponentID = str
@@ -9,8 +11,194 @@ type System = callable
 type EntityMap = dict[EntityID, dict[ComponentID, Component]]
 type ComponentMap = dict[ComponentID, dict[EntityID, Component]]
 type SystemMap = dict[SystemID, System]
+type Query = tuple[ComponentID, ...]
+type ViewMap = dict[Query, dict[EntityID, None]]
+type Prefab = dict[ComponentID, Component]
+type Storage = Literal['dict', 'archetype']
+# Field name -> float, int or bool
+type Schema = dict[str, type]
+# ('add', eid, ((cid, component), ...)), ('tag', eid, (tag, ...)),
+# ('remove', eid, (cid or tag, ...)) or ('despawn', eid, ())
+type Command = tuple[str, EntityID, tuple]
+
+class QueryStats(TypedDict):
+    hits: int
+    misses: int
+    matched: int
+
+class PrefabData(TypedDict):
+    components: Prefab
+    # Components every instance shares, the others are copied per instance
+    shared: frozenset[ComponentID]
+
+class ColumnSpec(TypedDict):
+    dtype: str
+    shape: tuple[int, ...]
+
+# A list, or a numpy.ndarray for components declared with declare_column
+type Column = list[Component]
+
+class Table(TypedDict):
+    cids: frozenset[ComponentID]
+    signature: int
+    eids: list[EntityID]
+    columns: dict[ComponentID, Column]
+
+type TableMap = dict[int, Table]
+type LocationMap = dict[EntityID, tuple[Table, int]]
+
+class SpatialGrid(TypedDict):
+    cell_size: float
+    cells: dict[tuple[int, int], set[EntityID]]
+    spans: dict[EntityID, tuple[int, int, int, int]]
+
+class Access(TypedDict):
+    reads: frozenset[ComponentID]
+    writes: frozenset[ComponentID]
+
+class Schedule(TypedDict):
+    systems: tuple[SystemID, ...]
+    stages: list[list[SystemID]]
+
+class Span(TypedDict):
+    name: str
+    start: float
+    duration: float
+    queries: int
+    matched: int
+    changes: int
+
+class Frame(TypedDict):
+    frame: int
+    start: float
+    duration: float
+    spans: list[Span]
+
+class Profiler(TypedDict):
+    frames: deque[Frame]
+    current: Frame | None
+    origin: float
+    count: int
+
+class Allocator(TypedDict):
+    generations: list[int]
+    free: list[int]
+
+class ChangeTicks(TypedDict):
+    added: dict[EntityID, int]
+    changed: dict[EntityID, int]
+    removed: dict[EntityID, int]
+
+class EventChannel(TypedDict):
+    kind: type
+    previous: list[tuple[int, object]]
+    current: list[tuple[int, object]]
+
+# Called as observer(world, eid, cid) after cid was added to eid or before
+# it is removed
+type Observer = callable
+# Called as condition(world, sid, run_state), the system runs if all agree
+type Condition = callable
+
+class RunState(TypedDict):
+    # dt and frames summed over the frames since the system last ran,
+    # including the current one
+    elapsed: float
+    frames: int
+
+class Codec(TypedDict):
+    encode: callable
+    decode: callable
+
+class AssetStore(TypedDict):
+    capacity: int
+    items: OrderedDict[object, object]
+    hits: int
+    misses: int
+
+class Timestep(TypedDict):
+    step: float
+    max_steps: int
+    accumulator: float
+    # Fraction of a step left in the accumulator after the last advance
+    alpha: float
+    steps: int
+    # Seconds of frame time skipped by the catch-up limit
+    dropped: float
+
+type TimerID = int
+# (deadline, timer, eid, cid, component), where a cid of None despawns
+type Timer = tuple[float, TimerID, EntityID, ComponentID | None, Component]
+
+class Timers(TypedDict):
+    # Simulation seconds, advanced by the dt of every run_systems call
+    time: float
+    heap: list[Timer]
+    next: TimerID
+    # Timers still in the heap
+    pending: set[TimerID]
+    # Cancelled timers still in the heap
+    cancelled: set[TimerID]
+
+class MemoryReport(TypedDict):
+    entities: int
+    components: dict[ComponentID, int]
+    # Bytes the components with a schema would take packed into arrays
+    packed: dict[ComponentID, int]
+    index: int
+    total: int
 
 class WorldData(TypedDict):
     entities: EntityMap
     components: ComponentMap
-    systems: SystemMap
\ No newline at end of file
+    systems: SystemMap
+    views: ViewMap
+    query_stats: QueryStats
+    storage: Storage
+    tables: TableMap
+    locations: LocationMap
+    columns: dict[ComponentID, ColumnSpec]
+    commands: list[Command]
+    spatial: SpatialGrid | None
+    access: dict[SystemID, Access]
+    schedule: Schedule
+    executor: Executor | None
+    changes: int
+    profiler: Profiler | None
+    registry: dict[ComponentID, int]
+    query_masks: dict[Query, int]
+    signatures: dict[EntityID, int]
+    allocator: Allocator
+    assets: AssetStore
+    prefabs: dict[str, PrefabData]
+    tick: int
+    last_run: dict[SystemID, int]
+    tracked: dict[ComponentID, ChangeTicks]
+    events: dict[str, EventChannel]
+    # 'add' or 'remove' -> observed cid -> observers
+    observers: dict[str, dict[ComponentID, list[Observer]]]
+    codecs: dict[ComponentID, Codec]
+    timestep: Timestep | None
+    # Interpolated cid -> eid -> value before the last fixed step
+    previous: dict[ComponentID, dict[EntityID, Component]]
+    pending_events: list[object]
+    timers: Timers
+    # Tag -> entities carrying it; tags have a signature bit but no value
+    tags: dict[ComponentID, dict[EntityID, None]]
+    # Component types generated by declare_schema
+    schemas: dict[ComponentID, type]
+    conditions: dict[SystemID, list[Condition]]
+    run_states: dict[SystemID, RunState]
+
+class WorldManager(TypedDict):
+    create: callable
+    factories: dict[WorldID, callable]
+    directory: str
+    budget: int
+    # Least recently used first
+    resident: OrderedDict[WorldID, WorldData]
+    evicted: dict[WorldID, str]
+    active: WorldID | None
+    on_evict: callable
+    # Bytes of each resident world when it was last switched to or from
+    sizes: dict[WorldID, int]